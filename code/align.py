@@ -14,10 +14,10 @@ And more!!
 Not actually more, that is all it does
 """
 
-from difflib import SequenceMatcher
-from collections import Counter
+from collections import namedtuple, Counter
+import numpy as np
 from homoglyph_checker import is_error_homoglyphic
-import re
+from alignment_backends import get_opcodes, prepared_gold
 import string
 
 '''HTML Color Sequence Tags'''
@@ -39,10 +39,17 @@ end_codes = {'equal': '',
             'replace': HTML_end,
             'delete': '</span>'}
 
+markdown_codes = {'equal': ('', ''),
+                  'insert': (bold, bold),
+                  'replace': (strike, bold),
+                  'delete': (strike, strike)}
+
 '''Constants--These are all arbitrary/tunable'''
 MIN_COMBO_DIST = 10
 MIN_EQUAL_DIST = 10
 MIN_MAJOR_ERROR_CHARS = 5
+'''Deepest level of regrouping before a span's opcodes are taken as they are. None is unbounded'''
+MAX_ALIGNMENT_DEPTH = None
 
 def combine_step_groups(steps):
     step_groups = []
@@ -99,29 +106,360 @@ def align_texts_with_spellchecking(ocr, gold, outfile = None, spellchecks = None
         return [align_texts(apply_spellchecking(ocr, spellcheck)) for spellcheck in spellchecks]
 '''
 
+'''Similarity screening thresholds. Before aligning, cheap lower bounds on the edit distance between
+the two texts (as a fraction of the longer text's length) are checked, and a pair whose bound is
+above the threshold can't be a usable transcription, so it is marked catastrophic without aligning
+it. None turns a check off, which is the default for both. These are only the defaults of
+catastrophic_reason: align_json_texts takes its thresholds as parameters and passes them on with each job'''
+SCREEN_MAX_HISTOGRAM_DISTANCE = None
+SCREEN_MAX_QGRAM_DISTANCE = None
+SCREEN_Q = 3
+
+'''Default of catastrophic_reason's thresholds, standing for the SCREEN_* settings above (so that
+passing None can turn a screen off whatever they are)'''
+SCREEN_DEFAULT = object()
+
+def histogram_distance_bound(ocr, gold):
+    '''Lower bound on the edit distance from character counts: every surplus character on the longer
+    side of the count difference needs its own edit'''
+    ocr_counts, gold_counts = Counter(ocr), Counter(gold)
+    ocr_counts.subtract(gold_counts)
+    surplus = sum(count for count in ocr_counts.values() if count > 0)
+    deficit = -sum(count for count in ocr_counts.values() if count < 0)
+    return max(surplus, deficit)
+
+def qgram_distance_bound(ocr, gold, q = SCREEN_Q):
+    '''Lower bound on the edit distance from q-gram counts (Ukkonen): one edit changes at most q of
+    the q-grams of each string, so at most 2q of the q-gram count difference'''
+    ocr_counts = Counter(ocr[i:i + q] for i in range(len(ocr) - q + 1))
+    ocr_counts.subtract(gold[i:i + q] for i in range(len(gold) - q + 1))
+    return sum(abs(count) for count in ocr_counts.values()) / (2 * q)
+
 '''Checking for some simple conditions that mark that the ocr has gone serioulsy wrong'''
+def catastrophic_reason(ocr, gold, max_histogram_distance = SCREEN_DEFAULT, max_qgram_distance = SCREEN_DEFAULT):
+    '''
+    Which of the conditions marking the pair as catastrophic it meets, if any: 'empty', 'length' (one
+    text > 2x the other), 'histogram' or 'qgram' (the similarity screens, with thresholds defaulting
+    to SCREEN_MAX_HISTOGRAM_DISTANCE/SCREEN_MAX_QGRAM_DISTANCE, None turning one off). None if it
+    should be aligned
+    '''
+    if len(ocr) == 0 or len(gold) == 0: return 'empty' #Both empty: ??? Not really sure what appropriate behavior is here
+
+    if len(gold) > 10 and len(ocr) > 10:
+        if len(ocr) - len(gold) > len(gold): return 'length' #OCR text > 2x longer than gold text
+        if len(gold) - len(ocr) > len(ocr): return 'length' #gold text > 2x longer than OCR text
+
+    if max_histogram_distance is SCREEN_DEFAULT:
+        max_histogram_distance = SCREEN_MAX_HISTOGRAM_DISTANCE
+    if max_qgram_distance is SCREEN_DEFAULT:
+        max_qgram_distance = SCREEN_MAX_QGRAM_DISTANCE
+    longer = max(len(ocr), len(gold))
+    if max_histogram_distance is not None and histogram_distance_bound(ocr, gold) > max_histogram_distance * longer:
+        return 'histogram'
+    if max_qgram_distance is not None and qgram_distance_bound(ocr, gold) > max_qgram_distance * longer:
+        return 'qgram'
+
+    return None
+
 def check_for_catastrophic_error(ocr, gold):
-    try:
-        if len(ocr) == 0 and len(gold) == 0: return True #??? Not really sure what appropriate behavior is here
-        elif len(ocr) == 0: raise ValueError('OCR Text has length 0!')
-        elif len(gold) == 0: raise ValueError('Gold Text has lenght 0!')
+    return catastrophic_reason(ocr, gold) is not None
+
+'''A single piece of an alignment, in order. tag is the opcode tag, ocr/gold are the parts of the two
+strings it covers, error_type is which error_counts category it falls in and error is the (possibly empty)
+list of reportable (gold, ocr) substitutions in it. Empty 'equal' segments stand in for the 'none'
+placeholder counts align_texts has always added for empty step groups and at the start of each
+bottom level group; they render to nothing.'''
+alignment_segment = namedtuple('alignment_segment', ['tag', 'ocr', 'gold', 'error_type', 'error'])
+
+ERROR_TYPES = ('homoglyph', 'nonhomoglyph', 'major', 'none', 'catastrophic')
+
+_placeholder_segment = alignment_segment('equal', '', '', 'none', [])
+
+def make_segment(edit_type, ocr_part, gold_part, list_error_len = 0):
+    '''Figures out if an error is major, homoglyphic, or non-homoglyphic'''
+    '''Anything with > MIN_MAJOR_ERROR_CHARS characters out of place is considered a major error'''
+    '''(classify_opcodes does the same over opcode arrays, for count_alignment_errors_batch)'''
+    if edit_type == 'equal':
+        error_type = 'none'
+    elif max(len(ocr_part), len(gold_part)) > MIN_MAJOR_ERROR_CHARS:
+        error_type = 'major'
+    elif edit_type in ['insert', 'delete']:
+        error_type = 'nonhomoglyph'
+    else:
+        error_type = is_error_homoglyphic(ocr_part, gold_part)
+
+    ''' Finds the actual error (which characters have been replaced by which other characters?)
+    Reports the error only if reporting conditions are met--as of now that's if both gold text
+    and ocred text in the error are a set length '''
+    if edit_type == 'replace' and len(ocr_part) == list_error_len and len(gold_part) == list_error_len:
+        error = [(gold_part, ocr_part)]
+    else:
+        error = []
 
-        if len(gold) > 10 and len(ocr) > 10:
-            if len(ocr) - len(gold) > len(gold): raise ValueError('OCR text > 2x longer than gold text')
-            if len(gold) - len(ocr) > len(ocr): raise ValueError('gold text > 2x longer than OCR text')
+    return alignment_segment(edit_type, ocr_part, gold_part, error_type, error)
 
+'''Goes through a few common cases to determine whether the error at hand is 'real'
+(i.e. needs fixing) or is just an artifact of spell checking/strange punctuation'''
+def is_error_real(segment):
+    if segment.ocr.lower() == segment.gold.lower():
         return False
-    except ValueError:
+    elif segment.tag == 'insert' and segment.gold == '- ':
+        return False
+    elif segment.tag == 'insert' and all([i in string.punctuation or i == ' ' for i in segment.gold]):
+        return False
+    else:
         return True
 
-def align_texts(ocr, gold, list_error_len = 0):
+def iter_alignment(ocr, gold, list_error_len = 0, backend = 'difflib', stats = None, max_depth = None):
+    """
+    Lazy version of align_texts: same parameters, but yields the alignment_segments making up
+    the alignment in order instead of building the display string. Callers that only want counts
+    (see count_alignment_errors) never pay for any rendering.
+
+    If a stats dict is passed, stats['max_depth'] is kept at the deepest level of regrouping
+    reached (the whole texts being depth 1).
+    """
+    if max_depth is None:
+        max_depth = MAX_ALIGNMENT_DEPTH
+
+    '''Groups that need realigning are worked through depth first with an explicit stack rather than
+    by recursing, so arbitrarily garbled articles never run into the recursion limit. Each level on
+    the stack is just its two strings, an iterator over its step groups and its depth. work is the
+    next (ocr, gold, depth) span to align, if any'''
+    stack = []
+    work = (ocr, gold, 1)
+    while work is not None or len(stack) > 0:
+        if work is not None:
+            ocr, gold, depth = work
+            work = None
+            if stats is not None:
+                stats['max_depth'] = max(stats.get('max_depth', 0), depth)
+
+            '''Create the set of opcodes/steps for editing the ocr string into the gold one'''
+            steps = get_opcodes(ocr, gold, backend = backend)
+            if isinstance(gold, prepared_gold):
+                gold = gold.text
+
+            '''Form groups of opcodes (which tell you how the OCR string needs to be edited to
+            make the ground truth one). The components of each group will be reprocessed together
+            as a smaller string. We do this because the opcodes tend to be inaccurate with larger
+            strings but more accurate/granular with shorter ones.'''
+            step_groups, continue_flag = combine_step_groups(steps)
+
+            '''Continue_Flag signals whether we've reached the bottom of the regrouping or not.
+            Determined by the presence of at least one 'equal' section of length at least MIN_EQUAL_DIST.
+            If there are no long equal sections left in the strings (or the span is already max_depth
+            levels down), we process the steps directly'''
+            if continue_flag and (max_depth is None or depth < max_depth):
+                stack.append((ocr, gold, iter(step_groups), depth))
+            else:
+                yield _placeholder_segment
+
+                for edit_type, ocr0, ocr1, gold0, gold1 in steps:
+                    # if is_error_real(segment):
+                    yield make_segment(edit_type, ocr[ocr0:ocr1], gold[gold0:gold1], list_error_len)
+                continue
+
+        '''Each group of opcodes gets processed on its own, sending everything in the group's coverage
+        into a new alignment if necessary. Needed because with large strings the opcodes aren't very granular'''
+        ocr, gold, groups, depth = stack[-1]
+        for group in groups:
+            if len(group) == 0:
+                yield _placeholder_segment
+            elif len(group) == 1 and group[0][0] in ['equal', 'delete', 'insert']:
+                edit_type, ocr0, ocr1, gold0, gold1 = group[0]
+                yield make_segment(edit_type, ocr[ocr0:ocr1], gold[gold0:gold1], list_error_len)
+            else:
+                ocr_start, ocr_end = group[0][1], group[-1][2]
+                gold_start, gold_end = group[0][3], group[-1][4]
+                work = (ocr[ocr_start:ocr_end], gold[gold_start:gold_end], depth + 1)
+                break
+        else:
+            stack.pop()
+
+def render_segment(segment, style = 'html'):
+    """
+    Gets the display string for a particular segment. 'html' (the align_texts display string) colors
+    deletions red and insertions green with HTML tags, 'markdown' strikes through deletions and bolds insertions.
+    """
+    edit_type = segment.tag
+
+    #Constructs the 'inside' portion of the display string (the part that will be surrounded by the markers)
+    if edit_type == 'equal' or edit_type == 'insert':
+        cur_str = segment.gold
+    elif edit_type == 'delete':
+        cur_str = segment.ocr
+    elif style == 'html':
+        cur_str = segment.ocr + HTML_end + HTML_green + segment.gold
+    else:
+        cur_str = segment.ocr + strike + bold + segment.gold
+
+    #Replace spaces with underscores in insert operations to make them more obvious
+    if edit_type in ['insert', 'delete'] and cur_str.count(' ') < 4:
+        cur_str = cur_str.replace(' ', '_')
+
+    if style == 'html':
+        return color_codes[edit_type] + cur_str + end_codes[edit_type]
+    else:
+        return markdown_codes[edit_type][0] + cur_str + markdown_codes[edit_type][1]
+
+def render_alignment(segments, style = 'html'):
+    '''Display string for a stream of segments, built with a single join'''
+    return ''.join([render_segment(segment, style = style) for segment in segments])
+
+'''Integer codes for the opcode tags in opcode arrays, and for the error types (in ERROR_TYPES order)'''
+EQUAL, REPLACE, INSERT, DELETE = 0, 1, 2, 3
+TAG_CODES = {'equal': EQUAL, 'replace': REPLACE, 'insert': INSERT, 'delete': DELETE}
+HOMOGLYPH, NONHOMOGLYPH, MAJOR, NONE, CATASTROPHIC = range(5)
+
+def opcode_array(steps):
+    '''(n, 5) int32 array of (tag code, i1, i2, j1, j2) rows for a list of opcodes'''
+    ops = np.empty((len(steps), 5), dtype = np.int32)
+    if len(steps) > 0:
+        ops[:] = [(TAG_CODES[tag], i1, i2, j1, j2) for tag, i1, i2, j1, j2 in steps]
+    return ops
+
+def classify_opcodes(ops):
+    '''Error type codes of an opcode array's rows (as make_segment), with -1 for the replaces that
+    still need the homoglyph check'''
+    tags = ops[:, 0]
+    lengths = np.maximum(ops[:, 2] - ops[:, 1], ops[:, 4] - ops[:, 3])
+    return np.where(tags == EQUAL, NONE,
+                    np.where(lengths > MIN_MAJOR_ERROR_CHARS, MAJOR,
+                             np.where(tags == REPLACE, -1, NONHOMOGLYPH)))
+
+def count_alignment_errors_batch(pairs, list_error_len = 0, backend = 'difflib', stats = None, max_depth = None):
+    """
+    count_alignment_errors for many (ocr, gold) pairs at once, returning a list of (error_counts,
+    error_list), one per pair, identical to what count_alignment_errors returns for each.
+
+    The regrouping iter_alignment does depth first is done here a level at a time: the opcodes of
+    every span at the same depth (across all the pairs) go into one opcode array, and the grouping
+    on MIN_EQUAL_DIST, the classification of the steps taken as they are and the counting are
+    vectorized over that whole array. Only getting the opcodes, the homoglyph checks of short
+    replaces and cutting out the spans to realign are done one at a time. The numpy calls have a
+    fixed cost, so this only pays off over a batch of pairs (a few dozen or more): for a single
+    pair the step by step count_alignment_errors is faster.
+
+    Nothing calls this by default; align_json_texts counts with count_alignment_errors. benchmark.py
+    times the two against each other and raises if their results ever differ, so a change to
+    make_segment or the regrouping that isn't made here too shows up on the next benchmark run.
+    Golds may be alignment_backends.prepared_gold objects, as for count_alignment_errors.
+    """
+    if max_depth is None:
+        max_depth = MAX_ALIGNMENT_DEPTH
+
+    counts = np.zeros((len(pairs), len(ERROR_TYPES)), dtype = np.int64)
+    listed = []
+
+    '''Spans to align at this depth, as (pair index, ocr offset, ocr, gold)'''
+    spans = [(p, 0, ocr, gold) for p, (ocr, gold) in enumerate(pairs)]
+    depth = 1
+    while len(spans) > 0:
+        if stats is not None:
+            stats['max_depth'] = max(stats.get('max_depth', 0), depth)
+
+        steps = [get_opcodes(ocr, gold, backend = backend) for _, _, ocr, gold in spans]
+        spans = [(p, offset, ocr, gold.text if isinstance(gold, prepared_gold) else gold)
+                            for p, offset, ocr, gold in spans]
+        n_steps = np.array([len(span_steps) for span_steps in steps], dtype = np.int64)
+        ops = opcode_array([step for span_steps in steps for step in span_steps])
+        span_ids = np.repeat(np.arange(len(spans)), n_steps)
+        span_pairs = np.array([p for p, _, _, _ in spans], dtype = np.int64)
+        tags = ops[:, 0]
+
+        '''A span is regrouped if it has an 'equal' longer than MIN_EQUAL_DIST (and isn't max_depth down).
+        Its groups are numbered 2 * (long equals before the step) + (1 if the step is a long equal), so
+        the long equals are groups of their own with the (possibly empty) runs between them around them'''
+        long_equal = (tags == EQUAL) & (ops[:, 2] - ops[:, 1] > MIN_EQUAL_DIST)
+        n_long = np.bincount(span_ids[long_equal], minlength = len(spans))
+        regroup = n_long > 0
+        if max_depth is not None and depth >= max_depth:
+            regroup[:] = False
+        regroup_step = regroup[span_ids]
+
+        long_before = np.concatenate([[0], np.cumsum(long_equal)])
+        span_first_step = np.concatenate([[0], np.cumsum(n_steps)[:-1]])
+        n_groups = np.where(regroup, 2 * n_long + 1, 0)
+        group_ids = np.concatenate([[0], np.cumsum(n_groups)[:-1]])[span_ids] + \
+                    2 * (long_before[:-1] - long_before[span_first_step][span_ids]) + long_equal
+        group_sizes = np.bincount(group_ids[regroup_step], minlength = int(n_groups.sum()))
+
+        '''Each bottom level span adds a 'none' placeholder, as does each empty group'''
+        np.add.at(counts[:, NONE], span_pairs[~regroup], 1)
+        np.add.at(counts[:, NONE], np.repeat(span_pairs, n_groups)[group_sizes == 0], 1)
+
+        '''Steps of bottom level spans and single step groups (other than replaces) are taken as they are'''
+        step_group_sizes = np.zeros(len(ops), dtype = np.int64)
+        step_group_sizes[regroup_step] = group_sizes[group_ids[regroup_step]]
+        direct = ~regroup_step | ((step_group_sizes == 1) & (tags != REPLACE))
+        direct_steps = np.flatnonzero(direct)
+        error_types = classify_opcodes(ops[direct_steps])
+        for k in np.flatnonzero(error_types < 0).tolist():
+            _, _, ocr, gold = spans[span_ids[direct_steps[k]]]
+            _, i1, i2, j1, j2 = ops[direct_steps[k]].tolist()
+            error_types[k] = ERROR_TYPES.index(is_error_homoglyphic(ocr[i1:i2], gold[j1:j2]))
+        np.add.at(counts, (span_pairs[span_ids[direct_steps]], error_types), 1)
+
+        '''Replaces of list_error_len on both sides are listed, by pair and position in the whole OCR text'''
+        listing = direct_steps[(tags[direct_steps] == REPLACE) &
+                               (ops[direct_steps, 2] - ops[direct_steps, 1] == list_error_len) &
+                               (ops[direct_steps, 4] - ops[direct_steps, 3] == list_error_len)]
+        for s, (_, i1, i2, j1, j2) in zip(span_ids[listing].tolist(), ops[listing].tolist()):
+            p, offset, ocr, gold = spans[s]
+            listed.append((p, offset + i1, gold[j1:j2], ocr[i1:i2]))
+
+        '''Every other (non-empty) group of a regrouped span is realigned on its own at the next depth'''
+        realign_steps = np.flatnonzero(regroup_step & ~direct)
+        group_start = np.diff(group_ids[realign_steps], prepend = -1) != 0
+        group_end = np.diff(group_ids[realign_steps], append = -1) != 0
+        next_spans = []
+        for s, first, last in zip(span_ids[realign_steps[group_start]].tolist(),
+                                  ops[realign_steps[group_start]].tolist(),
+                                  ops[realign_steps[group_end]].tolist()):
+            p, offset, ocr, gold = spans[s]
+            next_spans.append((p, offset + first[1], ocr[first[1]:last[2]], gold[first[3]:last[4]]))
+        spans = next_spans
+        depth += 1
+
+    results = [(dict(zip(ERROR_TYPES, pair_counts)), []) for pair_counts in counts.tolist()]
+    listed.sort()
+    for p, _, gold_error, ocr_error in listed:
+        results[p][1].append((gold_error, ocr_error))
+    return results
+
+def count_alignment_errors(ocr, gold, list_error_len = 0, backend = 'difflib', stats = None, max_depth = None):
+    """
+    align_texts without the display string: same parameters, returns (error_counts, error_list).
+    For many pairs count_alignment_errors_batch is faster.
+    """
+    error_counts = dict.fromkeys(ERROR_TYPES, 0)
+    error_list = []
+    for segment in iter_alignment(ocr, gold, list_error_len = list_error_len, backend = backend, stats = stats,
+                                  max_depth = max_depth):
+        error_counts[segment.error_type] += 1
+        error_list.extend(segment.error)
+    return error_counts, error_list
+
+def align_texts(ocr, gold, list_error_len = 0, backend = 'difflib', stats = None, max_depth = None):
     """
     Parameters
     ----------
     ocr : str
         String with errors (possibly) in it.
     gold : str
-        String to compare against.
+        String to compare against. May also be an alignment_backends.prepared_gold of it, when the
+        same gold text is aligned against more than once.
+    list_error_len : int
+        Length of the replace errors to be reported in the error list.
+    backend : str
+        Name of the alignment backend used to produce the opcodes, see alignment_backends.py.
+        'difflib' (default) is the original SequenceMatcher, 'myers' is the linear space Myers diff,
+        'anchored' aligns only the gaps between unique k-grams shared by the two strings.
+    stats : dict, optional
+        Filled in with statistics of the alignment, see iter_alignment.
+    max_depth : int, optional
+        Deepest level of regrouping of the opcodes, MAX_ALIGNMENT_DEPTH (unbounded) by default.
 
     Raises
     ------
@@ -147,140 +485,14 @@ def align_texts(ocr, gold, list_error_len = 0):
         Counting the number of the errors of each type identified in the strings passed. Major are
         errors involving more than MIN_MAJOR_ERROR_CHARS characters
     """
-
-
-    '''Create the set of opcodes/steps for editing the ocr string into the gold one'''
-    sm = SequenceMatcher(isjunk = None, a = ocr, b = gold, autojunk = False)
-    steps = sm.get_opcodes()
-
-
-    '''Form groups of opcodes (which tell you how the OCR string needs to be edited to
-    make the ground truth one). The components of each group will be reprocessed together
-    as a smaller string. We do this because the opcodes tend to be inaccurate with larger
-    strings but more accurate/granular with shorter ones.'''
-    step_groups, continue_flag = combine_step_groups(steps)
-
-    '''Helpers to process the opcodes into usable data'''
-
-    ''' Finds the actual error (which characters have been replaced by which other characters?)
-    Returns the error only if reporting conditions are met--as of now that's if both gold text
-    and ocred text in the error are a set length '''
-    def _get_step_error(cur_step):
-        edit_type, ocr0, ocr1, gold0, gold1 = cur_step
-        if edit_type != 'replace':
-            return []
-        elif ocr1 - ocr0 == list_error_len and gold1 - gold0 == list_error_len:
-            return [(gold[gold0:gold1], ocr[ocr0:ocr1])]
-        else:
-            return []
-
-    '''Figures out if an error is major, homoglyphic, or non-homoglyphic'''
-    def _get_step_error_type(cur_step):
-        edit_type, ocr0, ocr1, gold0, gold1 = cur_step
-        '''Anything with > MIN_MAJOR_ERROR_CHARS characters out of place is considered a major error'''
-        if edit_type == 'equal':
-            return 'none'
-        elif max(ocr1 - ocr0, gold1 - gold0) > MIN_MAJOR_ERROR_CHARS:
-            return 'major'
-        elif edit_type in ['insert', 'delete']:
-            return 'nonhomoglyph'
-        else:
-            return is_error_homoglyphic(ocr[ocr0:ocr1], gold[gold0:gold1])
-
-    '''Gets the display string for a particular opcode/step'''
-    def _get_step_disp(cur_step):
-        edit_type, ocr0, ocr1, gold0, gold1 = cur_step
-
-        #Constructs the 'inside' portion of the display string (the part that will be surrounded by html markers)
-        if edit_type == 'equal' or edit_type == 'insert':
-            cur_str = gold[gold0:gold1]
-        elif edit_type == 'delete':
-            cur_str = ocr[ocr0:ocr1]
-        else:
-            cur_str = ocr[ocr0:ocr1] + HTML_end + HTML_green + gold[gold0:gold1]
-
-        #Replace spaces with underscores in insert operations to make them more obvious
-        if edit_type in ['insert', 'delete'] and cur_str.count(' ') < 4:
-            cur_str = re.sub(' ', '_', cur_str)
-
-        return color_codes[edit_type] + cur_str + end_codes[edit_type], _get_step_error_type(cur_step),  \
-                        _get_step_error(cur_step)
-
-    '''Goes through a few common cases to determine whether the error at hand is 'real'
-    (i.e. needs fixing) or is just an artifact of spell checking/strange punctuation'''
-    def _is_error_real(cur_step):
-        edit_type, ocr0, ocr1, gold0, gold1 = cur_step
-
-        if ocr[ocr0:ocr1].lower() == gold[gold0:gold1].lower():
-            return False
-        elif edit_type == 'insert' and gold[gold0:gold1] == '- ':
-            return False
-        elif edit_type == 'insert' and all([i in string.punctuation or i == ' ' for i in gold[gold0:gold1]]):
-            return False
-        else:
-            return True
-
-    '''Gets the display string and error counts for a group of opcodes
-    Recurses if necessary, sending everything in the group's coverage into a
-    new call of align_texts. Needed because with large strings the opcodes aren't very granular'''
-    def _process_step_group(cur_group):
-        if len(cur_group) == 0:
-            return '', make_single_error_dict('none'), []
-        elif len(cur_group) == 1 and cur_group[0][0] in ['equal', 'delete', 'insert']:
-            # if _is_error_real(cur_group[0]):
-            step_str, error_type, error = _get_step_disp(cur_group[0])
-            return step_str, make_single_error_dict(error_type), error
-            # else:
-            #     return ocr[cur_group[0][1]:cur_group[0][2]], make_single_error_dict('none'), []
-        else:
-            ocr_start, ocr_end = cur_group[0][1], cur_group[-1][2]
-            gold_start, gold_end = cur_group[0][3], cur_group[-1][4]
-            return align_texts(ocr[ocr_start:ocr_end], gold[gold_start:gold_end], list_error_len = list_error_len)
-
-    '''A second check to confirm that it is indeed time to process individual steps.
-    Sometimes the sequence matcher object can get badly confused.
-
-    NOPE, NOT NEEDED: This was caused by some other faulty processes
-    '''
-    # if not continue_flag and len(ocr) > 100:
-    #     os, gs, size = sm.find_longest_match(0, len(ocr), 0, len(gold))
-    #     if size > 50:
-    #         print('used check 2!')
-    #         oe = os + size
-    #         ge = gs + size
-    #         continue_flag = True
-    #         step_groups = [('replace', 0, os, 0, gs), ('equal', os, oe, gs, ge), ('replace', oe, len(ocr), ge, len(gold))]
-
-
-
-
-    '''Continue_Flag signals whether we've reached the bottom of the recursion or not.
-    Determined by the presence of at least one 'equal' section of length at least MIN_EQUAL_DIST.
-    If there are no long equal sections left in the strings, we process the steps directly'''
-    disp_str = ''
+    error_counts = dict.fromkeys(ERROR_TYPES, 0)
     error_list = []
+    disp_parts = []
 
-    if continue_flag:
-        error_counter = Counter()
-
-        for group in step_groups:
-            group_str, group_counts, group_errors = _process_step_group(group)
-            disp_str += group_str
-            error_counter.update(group_counts)
-            error_list.extend(group_errors)
-
-        error_counts = dict(error_counter)
-    else:
-        error_counts = make_single_error_dict('none')
-
-        for step in steps:
-            # if _is_error_real(step):
-            step_str, error_type, error = _get_step_disp(step)
-            disp_str += step_str
-            error_counts[error_type] += 1
-            error_list.extend(error)
-            # else:
-            #     disp_str += ocr[step[1]:step[2]]
-
+    for segment in iter_alignment(ocr, gold, list_error_len = list_error_len, backend = backend, stats = stats,
+                                  max_depth = max_depth):
+        disp_parts.append(render_segment(segment))
+        error_counts[segment.error_type] += 1
+        error_list.extend(segment.error)
 
-    return disp_str, error_counts, error_list
\ No newline at end of file
+    return ''.join(disp_parts), error_counts, error_list
@@ -11,16 +11,24 @@ identifiying, classifying, and counting errors in the OCR-ed text.
 """
 
 import os, sys
-import json
 import re
-import numpy as np
-from collections import Counter
+from collections import Counter, OrderedDict, deque, namedtuple
+from itertools import islice, zip_longest
+from concurrent.futures import ProcessPoolExecutor
 
 
 sys.path.append(os.path.dirname(__file__))
-from align import align_texts, check_for_catastrophic_error, make_single_error_dict
-
-def clean_ocr_text(ocr_dict):
+from align import align_texts, count_alignment_errors, catastrophic_reason, make_single_error_dict
+from json_stream import iter_ocr_articles, iter_gold_annotations
+from alignment_cache import alignment_cache, get_alignment_cache
+from alignment_backends import prepared_gold
+from homoglyph_checker import get_homoglyph_table
+from checker_server import checker_client
+from text_normalizer import normalizer
+from error_matrix import accumulate_error_pairs, error_aggregator
+from instrumentation import stage_profiler, article_profile
+
+def clean_ocr_article(text):
     """
     Parameters
     ----------
@@ -31,20 +39,81 @@ def clean_ocr_text(ocr_dict):
     -------
     clean_text : string
         Same text, but with unicode unknown characters, and anything that's not in
-        [A-Za-z0-9], whitespace, or common punctuation
+        [A-Za-z0-9], whitespace, or common punctuation. Done by the shared, precompiled
+        text_normalizer (see text_normalizer.py)
 
     """
-    def _clean(text):
-        pattern = re.compile('[^A-Za-z0-9\s!#\$%&\*\(\)_\?\/\+-=\[\]:;\'",\.]+\u2014')
-        clean_text = pattern.sub('', text)
-        return clean_text
+    return normalizer.clean(text)
 
+def clean_ocr_text(ocr_dict):
+    """
+    Parameters
+    ----------
+    ocr_dict : dictionary
+        OCR dictionary in the format described in the align_json_texts signature
+
+    Returns
+    -------
+    ocr_dict : dictionary
+        Same dictionary, with every article run through clean_ocr_article
+
+    """
     for scan in ocr_dict.keys():
-        ocr_dict[scan] = {k: _clean(article) for k, article in ocr_dict[scan].items()}
+        ocr_dict[scan] = {k: clean_ocr_article(article) for k, article in ocr_dict[scan].items()}
 
     return ocr_dict
 
 
+def iter_clean_ocr_text_from_json(filename):
+    """
+    Parameters
+    ----------
+    filename : string
+        name of json to read. Needs to be in format described in align_json_texts
+        signature
+    Yields
+    ------
+    (scan_id, article_id, text) : tuple of strings
+        One article at a time, with the text processed through the same cleaning
+        as clean_ocr_text. The file is streamed rather than loaded all at once.
+
+    """
+    for scan, k, article in iter_ocr_articles(filename):
+        yield scan, k, clean_ocr_article(article)
+
+
+def iter_spellchecked_ocr_text(filename, method, client, id_set = None, batch_size = 64):
+    """
+    Parameters
+    ----------
+    filename : string
+        name of the (not spellchecked) OCR json to read, in the format described in
+        align_json_texts signature
+    method : string
+        spellchecking method, e.g. 'symspell', run by the checker server
+    client : checker_server.checker_client
+    id_set : set of ints, optional
+        Only these articles are sent off to be spellchecked.
+    batch_size : int
+        Number of articles sent to the server at a time.
+
+    Yields
+    ------
+    (scan_id, article_id, text) : tuple of strings
+        The same as iter_clean_ocr_text_from_json would for the file written by the spellcheck
+        method, but corrected by the already loaded checker on the server instead.
+    """
+    articles = ((scan, k, article) for scan, k, article in iter_ocr_articles(filename)
+                            if id_set is None or int(k) in id_set)
+    while True:
+        batch = list(islice(articles, batch_size))
+        if len(batch) == 0:
+            break
+        corrected, _ = client.correct(method, [article for _, _, article in batch])
+        for (scan, k, _), article in zip(batch, corrected):
+            yield scan, k, clean_ocr_article(article)
+
+
 def clean_ocr_text_from_json(filename):
     """
     Parameters
@@ -59,10 +128,11 @@ def clean_ocr_text_from_json(filename):
         clean_ocr_text function.
 
     """
-    with open(filename, 'r') as infile:
-        ocr_dict = json.load(infile)
+    ocr_dict = {}
+    for scan, k, article in iter_clean_ocr_text_from_json(filename):
+        ocr_dict.setdefault(scan, {})[k] = article
 
-    return clean_ocr_text(ocr_dict)
+    return ocr_dict
 
 
 def sanitize_before_aligning(text):
@@ -75,18 +145,35 @@ def sanitize_before_aligning(text):
     Returns
     -------
     sanitized_text: string.
-        Same text, with normalized whitespace (any whitespace replaced with a single space)
+        Same text, with normalized whitespace (any whitespace replaced with a single space).
+        Done by the shared, precompiled text_normalizer (see text_normalizer.py)
 
     """
-    text = re.sub('\s+', ' ', text) #Any length whitespace replace with a single space
-    text = re.sub('\u2014', '--', text) #em dash replaced with spaces--seem to often be equivalent in transcriptions
-    text = re.sub('[\u201c\u201d\u2018]', '"', text)
-    text = re.sub('\u2019', '\'', text)
-    text = re.sub(' \. ', ' \.', text)
-    text = re.sub(' , ', ', ', text)
-    text = re.sub(' \' ', '\'', text)
-
-    return text
+    return normalizer.sanitize(text)
+
+'''Gold texts already sanitized and prepared for aligning against (see alignment_backends.prepared_gold),
+by the key the job gave them, most recently used last. Per process: each worker keeps its own.
+align_json_texts hands out an article's jobs for every spellcheck method one after another, so a gold
+is used again straight after it's prepared, and only prepared twice when those jobs are split across
+two chunks (and so possibly two workers); the cache only has to hold the last few.
+Entries outlive the align_json_texts call that made them, so each one keeps the raw gold text it was
+prepared from and is only reused for that exact text (a different or edited gold file under the same
+key gets prepared again)'''
+PREPARED_GOLD_CACHE_SIZE = 64
+_prepared_golds = OrderedDict()
+
+def get_prepared_gold(gold_key, gold_text):
+    entry = _prepared_golds.get(gold_key)
+    if entry is not None and entry[0] == gold_text:
+        _prepared_golds.move_to_end(gold_key)
+        return entry[1]
+
+    prepared = prepared_gold(sanitize_before_aligning(gold_text))
+    _prepared_golds[gold_key] = (gold_text, prepared)
+    _prepared_golds.move_to_end(gold_key)
+    if len(_prepared_golds) > PREPARED_GOLD_CACHE_SIZE:
+        _prepared_golds.popitem(last = False)
+    return prepared
 
 def clean_string_for_markdown(text):
     text = re.sub('\*', '', text) #Avoiding bolding
@@ -140,25 +227,135 @@ def write_error_lists_to_file(outpath, method_error_lists, spellchecks):
 
     #Errors are lists of tuples in the form [(gold_chr, orc_chr), (gold_chr, ocr_chr), ... ]
     #Each indicating an instance where the character <gold_chr> has been mistranscribed as <ocr_chr>
+    #(or error_aggregators that have already counted them up as they came in)
+    #Counts are saved as sparse .npz files (see error_matrix.py), only holding the pairs that occur
     for errors, method in zip(method_error_lists, spellchecks):
         if method != '':
-            method_outpath = outpath[:-4] + '_' + method + '.npy'
-        else: method_outpath = outpath
+            method_outpath = outpath[:-4] + '_' + method + '.npz'
+        else: method_outpath = outpath[:-4] + '.npz'
 
-        max_ord = max([max(ord(x[0]), ord(x[1])) for x in errors])
-        error_counts = np.zeros(shape = (max_ord + 1, max_ord + 1))
-
-        for gold_chr, ocr_chr in errors:
-            error_counts[ord(gold_chr), ord(ocr_chr)] += 1
+        if isinstance(errors, error_aggregator):
+            error_counts = errors.to_sparse()
+        else:
+            error_counts = accumulate_error_pairs(errors)
 
         assert error_counts.sum() == len(errors)
 
-        np.save(method_outpath, error_counts)
+        error_counts.save(method_outpath)
+
 
+method_result = namedtuple('method_result', ['error_counts', 'errors'])
+
+aligned_pair = namedtuple('aligned_pair', ['text_str', 'text_counts', 'errors', 'n_chars', 'cache_hit', 'catastrophic',
+                                           'profile'])
+
+def align_text_pair(ocr_text, gold_text, list_error_len = 0, backend = 'difflib', cache_path = None, render = True,
+                    profile = False, gold_key = None, max_histogram_distance = None, max_qgram_distance = None):
+    """
+    Sanitizes and aligns a single (ocr, gold) pair, marking it catastrophic instead if
+    it fails the checks in align.catastrophic_reason. If cache_path is given, the
+    alignment is looked up in/saved to the alignment_cache kept there. With render = False
+    only the errors are counted and text_str is left empty. If gold_key is given, the gold
+    text is sanitized and prepared once under that key (see get_prepared_gold) and reused by
+    every later pair with the same key, e.g. the other spellcheck methods' versions of the article.
+    max_histogram_distance and max_qgram_distance are the similarity screen thresholds passed to
+    align.catastrophic_reason, None (the default) turning a screen off.
+
+    Returns
+    -------
+    aligned_pair: namedtuple with
+        text_str, text_counts, errors: the outputs of align_texts for the pair
+        n_chars: length of the sanitized OCR text
+        cache_hit: whether the alignment came out of the cache
+        catastrophic: why the pair was marked catastrophic (see align.catastrophic_reason), or None
+        profile: with profile = True, an instrumentation.article_profile of the time spent
+            on each step, otherwise None
+    """
+    profiler = stage_profiler(enabled = profile)
+    stats = {'max_depth': 0} if profile else None
+
+    ocr_clean = profiler.timed_call('sanitize', sanitize_before_aligning, ocr_text)
+    if gold_key is not None:
+        gold = profiler.timed_call('sanitize', get_prepared_gold, gold_key, gold_text)
+        gold_clean = gold.text
+    else:
+        gold = gold_clean = profiler.timed_call('sanitize', sanitize_before_aligning, gold_text)
+    def _pair(*result, cache_hit = False, catastrophic = None):
+        return aligned_pair(*result, len(ocr_clean), cache_hit, catastrophic,
+                            article_profile(profiler.times, stats['max_depth'], len(gold_clean)) if profile else None)
+
+    reason = profiler.timed_call('catastrophic_check', catastrophic_reason, ocr_clean, gold_clean,
+                                 max_histogram_distance, max_qgram_distance)
+    if reason is not None:
+        return _pair('', make_single_error_dict('catastrophic'), [], catastrophic = reason)
+
+    def _align():
+        if render:
+            return align_texts(ocr_clean, gold, list_error_len = list_error_len, backend = backend,
+                               stats = stats)
+        else:
+            return ('',) + count_alignment_errors(ocr_clean, gold, list_error_len = list_error_len,
+                                                  backend = backend, stats = stats)
+
+    if cache_path is None:
+        return _pair(*profiler.timed_call('align', _align))
+
+    cache = get_alignment_cache(cache_path)
+    key = alignment_cache.make_key(ocr_clean, gold_clean, list_error_len, backend, render)
+    result = profiler.timed_call('cache', cache.get, key)
+    if result is not None:
+        return _pair(*result, cache_hit = True)
+
+    result = profiler.timed_call('align', _align)
+    cache.put(key, result)
+    return _pair(*result)
+
+def _align_chunk(jobs):
+    return [align_text_pair(*job) for job in jobs]
+
+def align_jobs(jobs, workers = 1, chunksize = 16):
+    """
+    Parameters
+    ----------
+    jobs : iterable of argument tuples for align_text_pair
+    workers : int
+        Number of worker processes. 1 runs everything in this process.
+    chunksize : int
+        Number of jobs sent to a worker at a time.
+
+    Yields
+    ------
+    The align_text_pair outputs, in the same order as jobs regardless of which worker
+    finished first. At most 2 * workers chunks are in flight at once, so jobs can be a lazy
+    generator over a large corpus.
+    """
+    if workers <= 1:
+        for job in jobs:
+            yield align_text_pair(*job)
+        return
+
+    '''Load the homoglyph table here, so forked workers share it instead of each reading it'''
+    get_homoglyph_table().load()
+
+    jobs = iter(jobs)
+    with ProcessPoolExecutor(max_workers = workers) as pool:
+        pending = deque()
+        while True:
+            while len(pending) < 2 * workers:
+                chunk = list(islice(jobs, chunksize))
+                if len(chunk) == 0:
+                    break
+                pending.append(pool.submit(_align_chunk, chunk))
+            if len(pending) == 0:
+                break
+            yield from pending.popleft().result()
 
 
 def align_json_texts(ocr_filepath, gold_filepath, ids = None, outfile = None, \
-                     spellchecks = [], list_error_len = 0, error_list_outpath = None):
+                     spellchecks = [], list_error_len = 0, error_list_outpath = None, backend = 'difflib',
+                     workers = 1, chunksize = 16, cache_path = None, error_sample_size = 0, error_sample_seed = 0,
+                     checker_server = None, profile = False, slowest_n = 10, max_histogram_distance = None,
+                     max_qgram_distance = None):
     """
     Parameters
     ----------
@@ -177,7 +374,9 @@ def align_json_texts(ocr_filepath, gold_filepath, ids = None, outfile = None, \
 
     ids: list of ints
         If you want, you can pass in a list of annotation ids and, instead of going through all the texts
-        in the ocr file the function will just count the ones included in the list
+        in the ocr file the function will just count the ones included in the list. The articles are
+        streamed and aligned in the order they come in the ocr file, not in the order of ids (the
+        counts come out the same). A KeyError is raised if any of the ids isn't in the ocr file
 
     outfile: string
         If you want to visualize the errors in a specific passage, make sure that len(ids) = 1,
@@ -187,10 +386,57 @@ def align_json_texts(ocr_filepath, gold_filepath, ids = None, outfile = None, \
     spellchecks: a list of spellchecking algorithms to be applied to the ocr-ed text. Options are:
             'neuspell' - Neuspell spell checking
 
+    error_list_outpath: string
+        If given, counts of the single character substitutions found (see list_error_len) are saved
+        for each method as sparse .npz files next to this path, readable with error_matrix.load_error_counts
+
+    backend: string
+        Name of the alignment backend passed on to align_texts. 'difflib' (default), 'myers', which
+        runs in linear memory and is much faster on long articles, or 'anchored', which only aligns the
+        stretches between long runs the texts share and is the fastest on long articles. See alignment_backends.py.
+
+    workers: int
+        Number of processes to align articles with. The default of 1 aligns everything in this process.
+        The articles of every spellcheck method share the one pool of workers.
+
+    chunksize: int
+        Number of articles handed to a worker process at a time when workers > 1. Results are merged
+        back in id order, so the counts and error lists don't depend on scheduling.
+
+    cache_path: string
+        sqlite file holding an alignment_cache (see alignment_cache.py). Pairs whose sanitized texts
+        and settings are unchanged since they were last aligned are read from it instead of re-aligned.
+
+    error_sample_size: int
+        Substitution errors are counted up as each article is aligned rather than collected into one
+        list. This many of them are also kept as examples, sampled uniformly over the whole run.
+
+    error_sample_seed: int
+        Seed for picking the sampled errors, so the same run gives the same sample. None picks a
+        different sample each run.
+
+    checker_server: string
+        Socket path of a running checker_server (see checker_server.py). If given, the spellchecked
+        texts are made by sending the OCR texts to the server's already loaded checkers, rather
+        than read from previously written <ocr_file>_<method>.json files.
+
+    max_histogram_distance, max_qgram_distance: float
+        Similarity screen thresholds (see align.catastrophic_reason): a pair whose character histogram or
+        q-gram lower bound on the edit distance is above this fraction of the longer text's length is
+        marked catastrophic without being aligned. None, the default, turns the screen off.
+
+    profile: bool
+        Times each stage of the run (see instrumentation.py) and prints where the time went, the
+        deepest recursion reached in aligning, and the slowest_n slowest articles with their lengths.
+        Stage times of articles aligned in worker processes are added up across the workers.
+
     Returns
     -------
-    error_counts: dict
-        Dictionary in format
+    results: dict
+        Keyed by spellchecking method ('' for the uncorrected OCR), each a method_result with
+            errors: an error_aggregator (see error_matrix.py) of the substitution errors found, holding
+                their counts and the sample of examples
+            error_counts: dict in format
             {
                             'homoglyph': x,
                             'nonhomoglyph': x,
@@ -202,7 +448,9 @@ def align_json_texts(ocr_filepath, gold_filepath, ids = None, outfile = None, \
         must exceed to be classified as 'major' is specified in align.py. 'none' are not really errors,
         just a placeholder that should be ignored in all analysis. 'catastrophic' refers to articles/boxes
         that were completely mistranscribed, where one (but not both) of the ocr or gold strings are length 0,
-        or where the ocr transcription is > 2x or < .5x as long as the gold transcription
+        or where the ocr transcription is > 2x or < .5x as long as the gold transcription, or (if the
+        similarity screens are turned on, see max_histogram_distance) where the texts are too different to
+        be worth aligning. The number of articles the screens caught is printed for each method.
 
     """
     if outfile is not None and len(ids) != 1:
@@ -210,11 +458,14 @@ def align_json_texts(ocr_filepath, gold_filepath, ids = None, outfile = None, \
     if outfile is not None and len(spellchecks) > 0:
         raise ValueError('Can only write to file if either one or zero spellchecks are specified!')
 
-    with open(gold_filepath, 'r') as infile:
-        gold_dict = json.load(infile)['annotations']
+    id_set = set(ids) if ids is not None else None
+    profiler = stage_profiler(enabled = profile, slowest_n = slowest_n)
 
-    #Flatten out the gold transcriptions--get them indexed only by annotation id
-    gold_dict = {int(anno['id']): anno['text'] for anno in gold_dict}
+    #Flatten out the gold transcriptions--get them indexed only by annotation id. Streamed, so
+    # only the texts we're actually going to score are held onto
+    with profiler.stage('load'):
+        gold_dict = {anno_id: text for anno_id, text in iter_gold_annotations(gold_filepath)
+                                if id_set is None or anno_id in id_set}
 
     spellchecks.append('')
 
@@ -223,59 +474,132 @@ def align_json_texts(ocr_filepath, gold_filepath, ids = None, outfile = None, \
         method_error_counts = []
         method_disp_strs = []
         corrected_texts = []
-        method_error_lists = []
-    elif error_list_outpath is not None:
-        method_error_lists = []
+
+    results = {}
+    client = checker_client(checker_server) if checker_server is not None else None
 
     #Want to count errors/create visualzations for each of the spell checking methods provided
-    total_chars = 0
-    for method in spellchecks:
+    def _method_records(method):
         #Assumes that spell checked files are saved in the same directory as <original_file>_<spellchecking_method>.json
         filepath = ocr_filepath[:-5] + '_{}.json'.format(method) if method != '' else ocr_filepath
-        ocr_dict = clean_ocr_text_from_json(filepath)
 
-        #This is just 'flipping' the ocr dict
-        ocr_dict = {int(k): ocr_dict[img][k] for img in ocr_dict.keys() for k, v in ocr_dict[img].items() }
+        #Articles are streamed out of the file, indexed only by annotation id ('flipping' the ocr dict)
+        # and never all held in memory at once
+        #(Loading spellchecked articles from the server includes spellchecking and cleaning them)
+        if client is not None and method != '':
+            articles = profiler.timed_iter('load', iter_spellchecked_ocr_text(ocr_filepath, method, client,
+                                                                             id_set = id_set))
+        elif profile:
+            articles = ((scan, k, profiler.timed_call('clean', clean_ocr_article, article))
+                                for scan, k, article in profiler.timed_iter('load', iter_ocr_articles(filepath)))
+        else:
+            articles = iter_clean_ocr_text_from_json(filepath)
+        return filepath, ((int(k), article) for _, k, article in articles
+                                                if id_set is None or int(k) in id_set)
+
+    #Calls the align_texts function for every spell checking method (or not original version) and the
+    # gold standard/ground truth text supplied
+    #The jobs go article by article, each article's jobs for all the methods one after another, so its
+    # gold is sanitized and indexed once (under the (gold file, id) key) and reused for the other methods
+    # straight away, while it's still in get_prepared_gold's cache, rather than a whole method's worth
+    # of articles later. All the methods' jobs go through one pool, so no worker sits idle either
+    #The methods' files are read side by side. They normally list the articles in the same order, but an
+    # article one of them has further along waits in pending until every method has come to it, and
+    # articles some methods don't have at all are aligned for the others at the end
+    #The display string is only built when it's going to be written out
+    #Results come back in the same order as the jobs, so the methods and ids are matched back up with a queue
+    job_keys = deque()
+    last_articles = {}
+    def _jobs():
+        streams = [_method_records(method) for method in spellchecks]
+        seen_ids = {method: set() for method in spellchecks}
+        pending = OrderedDict()
+
+        def _article_jobs(text_id, articles):
+            for method in spellchecks:
+                if method in articles:
+                    job_keys.append((method, text_id))
+                    last_articles[method] = articles[method]
+                    yield articles[method], gold_dict[text_id], list_error_len, backend, cache_path, \
+                          outfile is not None, profile, (gold_filepath, text_id), max_histogram_distance, \
+                          max_qgram_distance
+
+        for records in zip_longest(*[records for _, records in streams]):
+            for method, record in zip(spellchecks, records):
+                if record is not None:
+                    text_id, article = record
+                    seen_ids[method].add(text_id)
+                    pending.setdefault(text_id, {})[method] = article
+            for text_id in dict.fromkeys(record[0] for record in records if record is not None):
+                if len(pending[text_id]) == len(spellchecks):
+                    yield from _article_jobs(text_id, pending.pop(text_id))
+
+        #Ids are only looked up as the files stream past, so ones a file doesn't have would otherwise go unnoticed
+        for method, (filepath, _) in zip(spellchecks, streams):
+            if id_set is not None and len(id_set - seen_ids[method]) > 0:
+                raise KeyError('ids not found in {}: {}'.format(filepath, sorted(id_set - seen_ids[method])))
+
+        for text_id, articles in pending.items():
+            yield from _article_jobs(text_id, articles)
+
+    #Visualizing a single article lists every error, otherwise they're only counted (and sampled)
+    error_counts = {method: Counter() for method in spellchecks}
+    errors_seen = {method: error_aggregator(sample_size = None if outfile is not None else error_sample_size,
+                                            seed = error_sample_seed)
+                                for method in spellchecks}
+    cache_hits = Counter()
+    catastrophic_reasons = {method: Counter() for method in spellchecks}
+    text_strs = {}
+
+    def _finish_method(method):
+        #Put together the eventual visualization to point out errors
+        if outfile is not None:
+            method_error_counts.append(dict(error_counts[method]))
+            method_disp_strs.append(text_strs.get(method, ''))
+            corrected_texts.append(sanitize_before_aligning(last_articles.get(method, '')))
 
-        if ids is None:
-            ids = list(ocr_dict.keys())
+        results[method] = method_result(dict(error_counts[method]), errors_seen[method])
 
-        error_counts = Counter()
-        error_list = []
+        print(method, dict(error_counts[method]), len(errors_seen[method]))
+        screened = catastrophic_reasons[method]['histogram'] + catastrophic_reasons[method]['qgram']
+        if screened > 0:
+            print('{} articles screened out as catastrophic before aligning {}'.format(screened,
+                                                                    dict(catastrophic_reasons[method])))
+        if cache_path is not None:
+            print('{} alignments read from cache'.format(cache_hits[method]))
 
-        #Calls the align_texts function for the spell checking method (or not original version) and the
-        # gold standard/ground truth text supplied
-        for text_id in ids:
-            ocr_clean, gold_clean = sanitize_before_aligning(ocr_dict[text_id]), sanitize_before_aligning(gold_dict[text_id])
-            total_chars += len(ocr_clean)
-            if check_for_catastrophic_error(ocr_clean, gold_clean):
-                text_str, text_counts, errors = '', make_single_error_dict('catastrophic'), []
-            else:
-                text_str, text_counts, errors = align_texts(ocr_clean, gold_clean, list_error_len = list_error_len)
+    total_chars = 0
+    for text_str, text_counts, errors, n_chars, cache_hit, catastrophic, article_times in align_jobs(
+                                                            _jobs(), workers = workers, chunksize = chunksize):
+        method, text_id = job_keys.popleft()
+        total_chars += n_chars
+        cache_hits[method] += cache_hit
+        if catastrophic is not None:
+            catastrophic_reasons[method][catastrophic] += 1
+        error_counts[method].update(text_counts)
+        errors_seen[method].update(errors)
+        text_strs[method] = text_str
+        profiler.record_article(method, text_id, n_chars, article_times)
+    for method in spellchecks:
+        _finish_method(method)
 
-            error_counts.update(text_counts)
-            error_list.extend(errors)
+    if client is not None:
+        client.close()
 
-        #Put together the eventual visualization to point out errors
+    with profiler.stage('write'):
         if outfile is not None:
-            method_error_counts.append(dict(error_counts))
-            method_disp_strs.append(text_str)
-            method_error_lists.append(error_list)
-            corrected_texts.append(sanitize_before_aligning(ocr_dict[text_id]))
+            write_viz_to_file(outfile, sanitize_before_aligning(gold_dict[ids[0]]), corrected_texts,
+                              method_disp_strs, method_error_counts,
+                              [results[method].errors.sample for method in spellchecks], spellchecks)
 
-        elif error_list_outpath is not None:
-            method_error_lists.append(error_list)
+        if error_list_outpath is not None:
+            write_error_lists_to_file(error_list_outpath, [results[method].errors for method in spellchecks],
+                                      spellchecks)
 
-        print(method, dict(error_counts), len(error_list))
+    print('{} characters of OCR text aligned'.format(total_chars))
+    profiler.report()
 
-    if outfile is not None:
-        write_viz_to_file(outfile, sanitize_before_aligning(gold_dict[ids[0]]), corrected_texts,
-                          method_disp_strs, method_error_counts, method_error_lists, spellchecks)
-
-    if error_list_outpath is not None:
-        write_error_lists_to_file(error_list_outpath, method_error_lists, spellchecks)
-
-    return None
+    return results
 
 #Debugging
 # os.chdir(r'C:\Users\bryan\Documents\NBER\OCR_error_correction\data')
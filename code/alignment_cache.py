@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+"""
+Persistent, content-addressed cache of align_texts results, so re-scoring a corpus
+only aligns the (ocr, gold) pairs that have actually changed since the last run.
+
+Entries are keyed by a sha256 of the sanitized OCR text, the gold text, list_error_len,
+the alignment backend, the homoglyph sensitivity and list and the tunable constants in
+align.py/alignment_backends.py, so changing any of those just misses rather than
+serving stale results. Each entry stores
+(disp_str, error_counts, error_list).
+
+The cache lives in a single sqlite file (standard library only). sqlite's locking makes
+it safe for several processes to read and write at once, e.g. the align_json_texts
+worker pool. Entries are evicted least recently used first once the file grows past
+max_bytes.
+"""
+
+import os
+import json
+import time
+import sqlite3
+import hashlib
+
+import align
+import alignment_backends
+import homoglyph_checker
+
+'''Number of writes between checks of the total cache size'''
+EVICT_INTERVAL = 256
+
+
+def alignment_settings():
+    '''Everything besides the texts themselves that changes what align_texts returns'''
+    table = homoglyph_checker.get_homoglyph_table()
+    return [align.MIN_COMBO_DIST, align.MIN_EQUAL_DIST, align.MIN_MAJOR_ERROR_CHARS, align.MAX_ALIGNMENT_DEPTH,
+            alignment_backends.MYERS_MIN_LENGTH, alignment_backends.ANCHOR_K, alignment_backends.ANCHOR_MIN_LENGTH,
+            alignment_backends.ANCHOR_INNER_BACKEND, table.sensitivity, table.list_hash]
+
+
+class alignment_cache:
+
+    def __init__(self, path, max_bytes = 1 << 30, timeout = 60):
+        """
+        Parameters
+        ----------
+        path : string
+            sqlite file to keep the cache in. Created if it doesn't exist.
+        max_bytes : int
+            Size cap on the stored results. Least recently used entries are dropped past this.
+        timeout : float
+            Seconds to wait on another process holding the write lock.
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._puts = 0
+
+        self.conn = sqlite3.connect(path, timeout = timeout, isolation_level = None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS alignments '
+                          '(key TEXT PRIMARY KEY, value TEXT, size INTEGER, last_access REAL)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS alignments_last_access ON alignments (last_access)')
+
+    @staticmethod
+    def make_key(ocr, gold, list_error_len = 0, backend = 'difflib', render = True):
+        key_data = json.dumps([ocr, gold, list_error_len, backend, render, alignment_settings()])
+        return hashlib.sha256(key_data.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        '''Returns (disp_str, error_counts, error_list), or None if the key isn't cached'''
+        row = self.conn.execute('SELECT value FROM alignments WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self.conn.execute('UPDATE alignments SET last_access = ? WHERE key = ?', (time.time(), key))
+        disp_str, error_counts, error_list = json.loads(row[0])
+        return disp_str, error_counts, [tuple(error) for error in error_list]
+
+    def put(self, key, result):
+        disp_str, error_counts, error_list = result
+        value = json.dumps([disp_str, error_counts, error_list])
+        self.conn.execute('INSERT OR REPLACE INTO alignments VALUES (?, ?, ?, ?)',
+                          (key, value, len(value), time.time()))
+
+        self._puts += 1
+        if self._puts % EVICT_INTERVAL == 0:
+            self.evict()
+
+    def evict(self):
+        '''Drops least recently used entries until the cache is back under max_bytes'''
+        self.conn.execute('BEGIN IMMEDIATE')
+        try:
+            total = self.conn.execute('SELECT COALESCE(SUM(size), 0) FROM alignments').fetchone()[0]
+            rows = self.conn.execute('SELECT key, size FROM alignments ORDER BY last_access').fetchall() \
+                            if total > self.max_bytes else []
+            stale = []
+            for key, size in rows:
+                if total <= self.max_bytes:
+                    break
+                stale.append((key,))
+                total -= size
+            self.conn.executemany('DELETE FROM alignments WHERE key = ?', stale)
+            self.conn.execute('COMMIT')
+        except Exception:
+            self.conn.execute('ROLLBACK')
+            raise
+
+    def __len__(self):
+        return self.conn.execute('SELECT COUNT(*) FROM alignments').fetchone()[0]
+
+    def close(self):
+        self.evict()
+        self.conn.close()
+
+
+'''Open caches, one connection per cache file per process. Keyed on the pid too, since sqlite
+connections must not be shared with forked worker processes'''
+_open_caches = {}
+
+def get_alignment_cache(path, max_bytes = 1 << 30):
+    key = (path, os.getpid())
+    if key not in _open_caches:
+        _open_caches[key] = alignment_cache(path, max_bytes = max_bytes)
+    return _open_caches[key]
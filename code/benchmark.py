@@ -0,0 +1,279 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks of the hot paths in scoring OCR against the gold transcriptions, so a change
+can be checked for being faster or slower rather than guessed at:
+
+    sanitize             - sanitize_before_aligning on the OCR and gold text
+    opcodes              - the alignment backend's opcodes alone
+    combine_step_groups  - grouping those opcodes
+    align_texts          - the whole alignment and error classification
+    count_alignment_errors       - counting the errors only, a pair at a time
+    count_alignment_errors_batch - the same with count_alignment_errors_batch, BATCH_SIZE pairs
+                           at a time (its articles are batches). Its counts and error lists
+                           are checked against count_alignment_errors' first, and a
+                           ValueError is raised if they differ
+    is_error_homoglyphic - classifying every non-equal segment of the alignment
+    visual_spell_checker - correcting every sentence (only with --spellcheck, since it
+                           loads the dictionaries first)
+    align_texts_<n>      - align_texts on a few synthetic articles of about n characters
+                           each, made by joining consecutive articles (--scale)
+
+Each stage reports articles/sec, chars/sec, p50/p99 per-article latency, the tracemalloc
+peak of a separate pass over the same inputs and the process' peak RSS after the stage.
+Results are saved as json along with the git commit, so runs on different commits can be
+compared:
+
+    python benchmark.py --out before.json
+    <change something>
+    python benchmark.py --out after.json --compare before.json
+"""
+
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import resource
+import subprocess
+import tracemalloc
+import numpy as np
+from itertools import cycle
+
+from align import align_texts, iter_alignment, combine_step_groups, check_for_catastrophic_error, \
+                  count_alignment_errors, count_alignment_errors_batch
+from alignment_backends import get_opcodes
+from align_json_texts import sanitize_before_aligning
+from homoglyph_checker import is_error_homoglyphic, get_homoglyph_table, HOMOGLYPH_FP
+from json_stream import iter_ocr_articles, iter_gold_annotations
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data')
+OCR_FP = os.path.join(DATA_DIR, 'tesseract_results.json')
+GOLD_FP = os.path.join(DATA_DIR, 'gold_data', 'gold_hand_transcription.json')
+
+'''Pairs per count_alignment_errors_batch call, the same as align_json_texts' default chunksize'''
+BATCH_SIZE = 16
+
+
+def git_commit():
+    '''(commit hash, whether the tree has uncommitted changes), or (None, None) outside a git checkout'''
+    cwd = os.path.dirname(os.path.abspath(__file__))
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd = cwd, capture_output = True,
+                                text = True, check = True).stdout.strip()
+        status = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd = cwd,
+                                capture_output = True, text = True, check = True).stdout
+        return commit, len(status.strip()) > 0
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+
+
+def load_pairs(ocr_fp = OCR_FP, gold_fp = GOLD_FP, limit = None):
+    '''Raw (ocr, gold) article pairs, in OCR file order'''
+    gold = dict(iter_gold_annotations(gold_fp))
+    pairs = [(article, gold[int(k)]) for _, k, article in iter_ocr_articles(ocr_fp) if int(k) in gold]
+    return pairs[:limit] if limit is not None else pairs
+
+
+def scale_pairs(pairs, target_chars, n_articles = 3):
+    '''n_articles synthetic (ocr, gold) articles of about target_chars gold characters each, made by
+    joining consecutive pairs (going round the pairs again if there aren't enough)'''
+    scaled = []
+    ocr_parts, gold_parts, n_chars = [], [], 0
+    for ocr, gold in cycle(pairs):
+        if len(scaled) == n_articles:
+            break
+        ocr_parts.append(ocr)
+        gold_parts.append(gold)
+        n_chars += len(gold)
+        if n_chars >= target_chars:
+            scaled.append((' '.join(ocr_parts), ' '.join(gold_parts)))
+            ocr_parts, gold_parts, n_chars = [], [], 0
+    return scaled
+
+
+def max_rss_mb():
+    #ru_maxrss is in kilobytes on Linux and bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1 << 20) if sys.platform == 'darwin' else rss / (1 << 10)
+
+
+def run_stage(name, function, inputs, sizes, repeat = 3, memory = True):
+    """
+    Parameters
+    ----------
+    name : string
+    function : callable
+        Called as function(*item) for each item of inputs.
+    inputs : non-empty list of argument tuples, one per article
+    sizes : list of ints
+        Number of characters in each article, for chars/sec.
+    repeat : int
+        Passes over inputs. Each article's latency is its fastest pass.
+    memory : bool
+        Whether to make an extra pass under tracemalloc for the peak traced memory.
+
+    Returns
+    -------
+    result : dict of the stage's measurements
+    """
+    latencies = np.full(len(inputs), np.inf)
+    for _ in range(repeat):
+        for i, item in enumerate(inputs):
+            start = time.perf_counter()
+            function(*item)
+            latencies[i] = min(latencies[i], time.perf_counter() - start)
+
+    peak = None
+    if memory:
+        tracemalloc.start()
+        for item in inputs:
+            function(*item)
+        peak = tracemalloc.get_traced_memory()[1] / (1 << 20)
+        tracemalloc.stop()
+
+    total = float(latencies.sum())
+    n_chars = int(sum(sizes))
+    return {'stage': name,
+            'articles': len(inputs),
+            'chars': n_chars,
+            'seconds': total,
+            'articles_per_sec': len(inputs) / total if total > 0 else None,
+            'chars_per_sec': n_chars / total if total > 0 else None,
+            'p50_ms': float(np.percentile(latencies, 50)) * 1000,
+            'p99_ms': float(np.percentile(latencies, 99)) * 1000,
+            'tracemalloc_peak_mb': peak,
+            'max_rss_mb': max_rss_mb()}
+
+
+def run_benchmarks(pairs, backend = 'difflib', list_error_len = 1, repeat = 3, memory = True,
+                   scale = (), spellcheck = False):
+    """
+    Parameters
+    ----------
+    pairs : list of raw (ocr, gold) article pairs, see load_pairs
+    backend : string
+        Alignment backend, see alignment_backends.py.
+    list_error_len, repeat, memory :
+        Passed on to align_texts / run_stage.
+    scale : list of ints
+        Synthetic article lengths to also run align_texts on, see scale_pairs.
+    spellcheck : bool
+        Whether to include visual_spell_checker.
+
+    Returns
+    -------
+    results : list of per-stage dicts, see run_stage
+    """
+    get_homoglyph_table().load()
+    results = []
+    def stage(name, function, inputs, sizes):
+        if len(inputs) == 0:
+            print('{:<24} no articles, skipped'.format(name))
+            return
+        result = run_stage(name, function, inputs, sizes, repeat = repeat, memory = memory)
+        print('{stage:<24} {articles:>6} articles {chars_per_sec:>14,.0f} chars/s '
+              '{p50_ms:>9.3f} p50 ms {p99_ms:>9.3f} p99 ms'.format(**result))
+        results.append(result)
+
+    sizes = [len(ocr) + len(gold) for ocr, gold in pairs]
+    stage('sanitize', lambda ocr, gold: (sanitize_before_aligning(ocr), sanitize_before_aligning(gold)),
+          pairs, sizes)
+
+    #Everything past sanitizing only sees the pairs that align_json_texts would align
+    sanitized = [(sanitize_before_aligning(ocr), sanitize_before_aligning(gold)) for ocr, gold in pairs]
+    sanitized = [(ocr, gold) for ocr, gold in sanitized if not check_for_catastrophic_error(ocr, gold)]
+    sizes = [len(ocr) + len(gold) for ocr, gold in sanitized]
+
+    stage('opcodes', lambda ocr, gold: get_opcodes(ocr, gold, backend), sanitized, sizes)
+    opcodes = [(get_opcodes(ocr, gold, backend),) for ocr, gold in sanitized]
+    stage('combine_step_groups', combine_step_groups, opcodes, sizes)
+    stage('align_texts', lambda ocr, gold: align_texts(ocr, gold, list_error_len, backend), sanitized, sizes)
+
+    counted = [count_alignment_errors(ocr, gold, list_error_len, backend) for ocr, gold in sanitized]
+    batches = [sanitized[i:i + BATCH_SIZE] for i in range(0, len(sanitized), BATCH_SIZE)]
+    batch_counted = [result for batch in batches
+                            for result in count_alignment_errors_batch(batch, list_error_len, backend)]
+    mismatched = sum(result != batch_result for result, batch_result in zip(counted, batch_counted))
+    if mismatched > 0:
+        raise ValueError('count_alignment_errors_batch disagrees with count_alignment_errors '
+                         'on {} of {} articles!'.format(mismatched, len(sanitized)))
+    stage('count_alignment_errors', lambda ocr, gold: count_alignment_errors(ocr, gold, list_error_len, backend),
+          sanitized, sizes)
+    stage('count_alignment_errors_batch', lambda batch: count_alignment_errors_batch(batch, list_error_len, backend),
+          [(batch,) for batch in batches], [sum(len(ocr) + len(gold) for ocr, gold in batch) for batch in batches])
+
+    segments = [([(segment.ocr, segment.gold) for segment in iter_alignment(ocr, gold, backend = backend)
+                                if segment.tag != 'equal'],) for ocr, gold in sanitized]
+    stage('is_error_homoglyphic', lambda errors: [is_error_homoglyphic(ocr, gold) for ocr, gold in errors],
+          segments, [sum(len(ocr) + len(gold) for ocr, gold in errors) for errors, in segments])
+
+    if spellcheck:
+        from homoglyph_spell_check_utils import create_worddict, create_homoglyph_dict, create_common_abbrev, \
+                                                visual_spell_checker, homoglyph_word_index
+        worddict, homoglyph_dict, abbrevset = create_worddict(), create_homoglyph_dict(
+                                                    homoglyph_fp = HOMOGLYPH_FP), create_common_abbrev()
+        index = homoglyph_word_index(worddict, homoglyph_dict)
+        def check_article(ocr):
+            return [visual_spell_checker(sentence, worddict, homoglyph_dict, abbrevset, index = index)
+                                for sentence in ocr.split('.') if len(sentence) > 0]
+        stage('visual_spell_checker', check_article, [(ocr,) for ocr, _ in pairs], [len(ocr) for ocr, _ in pairs])
+
+    for target_chars in scale:
+        scaled = scale_pairs(sanitized, target_chars)
+        stage('align_texts_{}'.format(target_chars), lambda ocr, gold: align_texts(ocr, gold, list_error_len, backend),
+              scaled, [len(ocr) + len(gold) for ocr, gold in scaled])
+
+    return results
+
+
+def compare(results, baseline):
+    '''Prints each stage's chars/sec relative to the same stage in a baseline results file'''
+    baseline_stages = {result['stage']: result for result in baseline['stages']}
+    print('\ncompared to {}:'.format(baseline['meta'].get('git_commit')))
+    for result in results:
+        old = baseline_stages.get(result['stage'])
+        if old is not None and old['chars_per_sec'] and result['chars_per_sec']:
+            print('{:<24} {:6.2f}x chars/s   p99 {:9.3f} -> {:9.3f} ms'.format(
+                        result['stage'], result['chars_per_sec'] / old['chars_per_sec'], old['p99_ms'], result['p99_ms']))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Benchmark the alignment and spellcheck hot paths')
+    parser.add_argument('--ocr', default = OCR_FP)
+    parser.add_argument('--gold', default = GOLD_FP)
+    parser.add_argument('--limit', type = int, default = None, help = 'only use the first n articles')
+    parser.add_argument('--backend', default = 'difflib')
+    parser.add_argument('--repeat', type = int, default = 3)
+    parser.add_argument('--no-memory', action = 'store_true', help = 'skip the tracemalloc passes')
+    parser.add_argument('--scale', type = int, nargs = '*', default = [10000, 30000],
+                        help = 'synthetic article lengths (characters) to align')
+    parser.add_argument('--spellcheck', action = 'store_true', help = 'include visual_spell_checker')
+    parser.add_argument('--out', default = None, help = 'json file to save the results to')
+    parser.add_argument('--compare', default = None, help = 'results json of an earlier run to compare to')
+    args = parser.parse_args()
+
+    pairs = load_pairs(args.ocr, args.gold, args.limit)
+    results = run_benchmarks(pairs, backend = args.backend, repeat = args.repeat, memory = not args.no_memory,
+                             scale = args.scale, spellcheck = args.spellcheck)
+
+    commit, dirty = git_commit()
+    output = {'meta': {'git_commit': commit,
+                       'git_dirty': dirty,
+                       'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                       'python': platform.python_version(),
+                       'platform': platform.platform(),
+                       'backend': args.backend,
+                       'repeat': args.repeat,
+                       'articles': len(pairs),
+                       'ocr': os.path.basename(args.ocr),
+                       'gold': os.path.basename(args.gold)},
+              'stages': results}
+
+    if args.out is not None:
+        with open(args.out, 'w') as outfile:
+            json.dump(output, outfile, indent = 2)
+
+    if args.compare is not None:
+        with open(args.compare, 'r') as infile:
+            compare(results, json.load(infile))
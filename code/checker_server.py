@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+"""
+Long-lived local process that keeps spellcheckers loaded, so loading the spaCy (or any
+other slow) model is paid once rather than on every run. Start it with
+
+    python checker_server.py <socket_path> [<checker> ...]
+
+which listens on a Unix socket and optionally loads the listed checkers up front.
+Checkers are otherwise loaded the first time they're asked for, and stay loaded.
+
+The protocol is one json object per line each way. A request
+
+    {"checker": "symspell_checker", "options": {...}, "articles": ["...", ...]}
+
+names a spellcheck class from spell_checking_methods (or its method name, e.g. 'symspell'),
+the keyword arguments to construct it with, and a batch of articles. The response is
+
+    {"corrected": ["...", ...], "load_time": <s>, "run_time": <s>}
+
+where load_time is 0 if the checker was already loaded, or {"error": "<message>"}.
+{"command": "status"} lists the loaded checkers and {"command": "shutdown"} stops the server.
+
+checker_client is the other end, used by spellcheck.spellcheck(server = ...) and
+align_json_texts(checker_server = ...).
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import threading
+import socketserver
+
+'''Method names used in the spellchecked file names, e.g. <ocr_file>_symspell.json (only the ones
+some checker actually writes: visual_homoglyph_checker's is new_visual_homoglyph)'''
+CHECKER_NAMES = {'symspell': 'symspell_checker',
+                 'spacy': 'spacy_checker',
+                 'new_visual_homoglyph': 'visual_homoglyph_checker'}
+
+
+class checker_client:
+
+    def __init__(self, socket_path, timeout = None):
+        self.socket_path = socket_path
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(timeout)
+        self.sock.connect(socket_path)
+        self.reader = self.sock.makefile('rb')
+
+    def request(self, message):
+        self.sock.sendall(json.dumps(message).encode('utf-8') + b'\n')
+        line = self.reader.readline()
+        if len(line) == 0:
+            raise ConnectionError('Checker server at {} closed the connection'.format(self.socket_path))
+        response = json.loads(line)
+        if 'error' in response:
+            raise RuntimeError('Checker server error: {}'.format(response['error']))
+        return response
+
+    def correct(self, checker, articles, **options):
+        """
+        Parameters
+        ----------
+        checker : string
+            spellcheck class name (or method name, see CHECKER_NAMES).
+        articles : list of strings
+        options : keyword arguments the checker is constructed with on the server.
+
+        Returns
+        -------
+        corrected : list of strings, in the same order as articles
+        load_time : float
+            Seconds the server spent loading the checker for this request, 0 if it was already loaded.
+        """
+        response = self.request({'checker': checker, 'options': options, 'articles': articles})
+        return response['corrected'], response['load_time']
+
+    def status(self):
+        return self.request({'command': 'status'})['checkers']
+
+    def shutdown(self):
+        self.request({'command': 'shutdown'})
+
+    def close(self):
+        self.reader.close()
+        self.sock.close()
+
+
+class _request_handler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                response = self.server.handle_request_message(json.loads(line))
+            except Exception as e:
+                response = {'error': '{}: {}'.format(type(e).__name__, e)}
+            self.wfile.write(json.dumps(response).encode('utf-8') + b'\n')
+            self.wfile.flush()
+            if response.get('shutting_down'):
+                break
+
+
+class checker_server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+
+    daemon_threads = True
+    #Seconds between checks for a shutdown command while waiting for connections
+    timeout = 0.5
+
+    def __init__(self, socket_path):
+        """
+        Each connection gets its own thread, but requests are handled one at a time, so a checker
+        (and its correction cache) is never used by two requests at once.
+        """
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        super().__init__(socket_path, _request_handler)
+        self.socket_path = socket_path
+        self.checkers = {}
+        self.stopping = False
+        self.lock = threading.Lock()
+
+    def get_checker(self, name, options):
+        '''The loaded checker for name and options, plus the seconds spent loading it now'''
+        #Imported here, so the client side doesn't need the checkers' dependencies
+        import spell_checking_methods
+
+        name = CHECKER_NAMES.get(name, name)
+        checker_class = getattr(spell_checking_methods, name, None)
+        if not isinstance(checker_class, type) or not issubclass(checker_class, spell_checking_methods.spellcheck):
+            raise ValueError('Unknown checker {}'.format(name))
+
+        #Keyed on the checker's full options, defaults included, so {} and the defaults spelled out
+        # share one loaded checker
+        loadin_start = time.time()
+        checker = checker_class(None, **options)
+        key = (name, json.dumps(checker.server_options(), sort_keys = True))
+        if key in self.checkers:
+            return self.checkers[key], 0
+
+        checker._load_checker()
+        load_time = time.time() - loadin_start
+        print('loaded {} {} in {:.1f}s'.format(name, checker.server_options(), load_time))
+
+        self.checkers[key] = checker
+        return checker, load_time
+
+    def handle_request_message(self, message):
+        command = message.get('command', 'correct')
+        if command == 'status':
+            return {'checkers': [[name, json.loads(options)] for name, options in self.checkers]}
+        if command == 'shutdown':
+            self.stopping = True
+            return {'shutting_down': True}
+
+        with self.lock:
+            checker, load_time = self.get_checker(message['checker'], message.get('options', {}))
+            run_start = time.time()
+            corrected = checker._check_articles(message['articles'])
+        return {'corrected': corrected, 'load_time': load_time, 'run_time': time.time() - run_start}
+
+    def serve(self):
+        '''Handles connections until a shutdown command comes in'''
+        while not self.stopping:
+            self.handle_request()
+
+    def server_close(self):
+        '''Saves any persistent correction caches and removes the socket file'''
+        for checker in self.checkers.values():
+            if checker.correction_cache is not None and checker.correction_cache.path is not None:
+                checker.correction_cache.save()
+        super().server_close()
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+
+
+if __name__ == '__main__':
+    server = checker_server(sys.argv[1])
+    for name in sys.argv[2:]:
+        server.get_checker(name, {})
+    print('checker server listening on {}'.format(sys.argv[1]))
+    try:
+        server.serve()
+    finally:
+        server.server_close()
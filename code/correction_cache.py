@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""
+Word level memo of spellchecker corrections. Newspaper OCR makes the same mistakes over
+and over, so visual_spell_checker and the symspell term lookups only need to work out the
+correction for each distinct token once and can reuse it everywhere else, across articles.
+
+A cache belongs to one checker configuration (the config passed in, e.g. the dictionary
+and edit distance used), so entries are keyed on the token alone. It holds at most
+max_size tokens, dropping the least recently used first, and counts hits and misses so
+it can be sized. With a path it can be saved at the end of a run and loaded at the start
+of the next one; a file saved under a different config is ignored.
+"""
+
+import os
+import json
+from collections import OrderedDict
+
+
+class correction_cache:
+
+    def __init__(self, max_size = 100000, path = None, config = None):
+        """
+        Parameters
+        ----------
+        max_size : int
+            Most tokens to keep corrections for.
+        path : string, optional
+            json file to load the cache from (if it exists) and save it to.
+        config : json serializable, optional
+            Settings of the checker whose corrections are cached. Saved with the cache and
+            compared on load, so corrections from a differently configured checker aren't reused.
+        """
+        self.max_size = max_size
+        self.path = path
+        self.config = config
+        self.hits = 0
+        self.misses = 0
+        self.entries = OrderedDict()
+        #Only listed once track_new_entries is called, see there
+        self.new_entries = None
+
+        if path is not None and os.path.exists(path):
+            self.load(path)
+
+    def get(self, token):
+        '''The cached correction of token, or None'''
+        correction = self.entries.get(token)
+        if correction is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.entries.move_to_end(token)
+        return correction
+
+    def put(self, token, correction):
+        self.entries[token] = correction
+        self.entries.move_to_end(token)
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last = False)
+        if self.new_entries is not None:
+            self.new_entries.append((token, correction))
+
+    def track_new_entries(self):
+        '''Starts listing the corrections put from now on, e.g. so a worker process's cache can be
+        merged back into the one its parent saves (see pop_new_entries)'''
+        self.new_entries = []
+
+    def pop_new_entries(self):
+        '''(token, correction) pairs put since track_new_entries or the last pop_new_entries'''
+        new_entries, self.new_entries = self.new_entries, []
+        return new_entries
+
+    def lookup(self, token, correct):
+        '''The correction of token, calling correct(token) only if it isn't cached yet'''
+        correction = self.get(token)
+        if correction is None:
+            correction = correct(token)
+            self.put(token, correction)
+        return correction
+
+    def __len__(self):
+        return len(self.entries)
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups > 0 else 0
+
+    def load(self, path):
+        with open(path, 'r') as infile:
+            saved = json.load(infile)
+        if saved['config'] != json.loads(json.dumps(self.config)):
+            print('Correction cache {} was saved with a different checker config, not using it'.format(path))
+            return
+        for token, correction in saved['entries'][-self.max_size:]:
+            self.entries[token] = correction
+
+    def save(self, path = None):
+        '''Writes the cache, least recently used first, to path (or the path it was made with)'''
+        path = self.path if path is None else path
+        with open(path, 'w') as outfile:
+            json.dump({'config': self.config, 'entries': list(self.entries.items())}, outfile)
+
+    def report(self):
+        print('correction cache: {} tokens, {} hits, {} misses, {:.1%} hit rate'.format(len(self), self.hits,
+                                                                                          self.misses, self.hit_rate()))
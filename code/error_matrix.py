@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+"""
+Sparse counts of character substitution errors, i.e. how many times the gold character
+<gold_chr> was transcribed as <ocr_chr>.
+
+These used to be dense (max_ord + 1, max_ord + 1) arrays saved with np.save, which a single
+em dash or CJK character would blow up to gigabytes. Here the errors are counted with
+vectorized numpy over a compact index of only the codepoints that occur, and saved in a
+COO layout (.npz) whose size depends only on the number of distinct (gold, ocr) pairs:
+
+    codepoints - sorted array of the codepoints that show up in any error
+    rows, cols - indices into codepoints of the gold and ocr character of each pair
+    counts     - number of times each (gold, ocr) pair occurred
+
+load_error_counts reads both that format and the old dense .npy files.
+
+error_aggregator counts errors as they come out of each alignment, so a whole corpus
+can be scored without ever holding every (gold_chr, ocr_chr) tuple in one list.
+"""
+
+import random
+import numpy as np
+from collections import Counter
+
+
+class sparse_error_counts:
+
+    def __init__(self, codepoints, rows, cols, counts):
+        self.codepoints = np.asarray(codepoints, dtype = np.int64)
+        self.rows = np.asarray(rows, dtype = np.int64)
+        self.cols = np.asarray(cols, dtype = np.int64)
+        self.counts = np.asarray(counts, dtype = np.int64)
+        self._lookup = {(int(self.codepoints[r]), int(self.codepoints[c])): int(n)
+                                for r, c, n in zip(self.rows, self.cols, self.counts)}
+
+    def __getitem__(self, ords):
+        '''counts[ord(gold_chr), ord(ocr_chr)], the same indexing as the old dense arrays'''
+        return self._lookup.get((int(ords[0]), int(ords[1])), 0)
+
+    def __len__(self):
+        return len(self._lookup)
+
+    def items(self):
+        '''Yields ((gold_chr, ocr_chr), count) for every pair that occurred'''
+        for (gold_ord, ocr_ord), count in self._lookup.items():
+            yield (chr(gold_ord), chr(ocr_ord)), count
+
+    def sum(self):
+        return int(self.counts.sum())
+
+    def to_dense(self):
+        '''The old (max_ord + 1, max_ord + 1) array. Only sensible for small codepoints!'''
+        size = int(self.codepoints.max()) + 1 if len(self.codepoints) > 0 else 0
+        dense = np.zeros(shape = (size, size))
+        np.add.at(dense, (self.codepoints[self.rows], self.codepoints[self.cols]), self.counts)
+        return dense
+
+    def save(self, outpath):
+        np.savez_compressed(outpath, codepoints = self.codepoints, rows = self.rows,
+                            cols = self.cols, counts = self.counts)
+
+
+class error_aggregator:
+
+    def __init__(self, sample_size = 0, seed = 0):
+        """
+        Parameters
+        ----------
+        sample_size : int or None
+            Number of example errors to keep, picked uniformly at random (reservoir sampling)
+            from everything seen. None keeps every error, in order, like the old error lists.
+        seed : int or None
+            Seed for the sampling. The fixed default makes the sample the same from run to run;
+            None seeds it from the system instead.
+        """
+        self.pair_counts = Counter()
+        self.total = 0
+        self.sample_size = sample_size
+        self.sample = []
+        self._rng = random.Random(seed)
+
+    def update(self, errors):
+        '''Adds a batch of (gold_chr, ocr_chr) errors, e.g. one article's error list'''
+        self.pair_counts.update(errors)
+
+        if self.sample_size is None:
+            self.sample.extend(errors)
+            self.total += len(errors)
+        elif self.sample_size == 0:
+            self.total += len(errors)
+        else:
+            for error in errors:
+                self.total += 1
+                if len(self.sample) < self.sample_size:
+                    self.sample.append(error)
+                else:
+                    i = self._rng.randrange(self.total)
+                    if i < self.sample_size:
+                        self.sample[i] = error
+
+    def __len__(self):
+        return self.total
+
+    def to_sparse(self):
+        '''sparse_error_counts of everything seen so far'''
+        pairs = list(self.pair_counts.items())
+        gold_ords = np.fromiter((ord(gold_chr) for (gold_chr, _), _ in pairs), dtype = np.int64, count = len(pairs))
+        ocr_ords = np.fromiter((ord(ocr_chr) for (_, ocr_chr), _ in pairs), dtype = np.int64, count = len(pairs))
+        counts = np.fromiter((count for _, count in pairs), dtype = np.int64, count = len(pairs))
+        return accumulate_error_ords(gold_ords, ocr_ords, weights = counts)
+
+
+def accumulate_error_pairs(errors):
+    """
+    Parameters
+    ----------
+    errors : list of (gold_chr, ocr_chr) tuples
+
+    Returns
+    -------
+    sparse_error_counts of the errors, built without any per-error Python arithmetic
+    """
+    gold_ords = np.fromiter((ord(gold_chr) for gold_chr, _ in errors), dtype = np.int64, count = len(errors))
+    ocr_ords = np.fromiter((ord(ocr_chr) for _, ocr_chr in errors), dtype = np.int64, count = len(errors))
+    return accumulate_error_ords(gold_ords, ocr_ords)
+
+
+def accumulate_error_ords(gold_ords, ocr_ords, weights = None):
+    """
+    Parameters
+    ----------
+    gold_ords, ocr_ords : arrays of ints
+        Codepoints of the gold and OCR character of each error.
+    weights : array of ints, optional
+        Number of times each error occurred (1 each if not given).
+
+    Returns
+    -------
+    sparse_error_counts of the errors
+    """
+    gold_ords = np.asarray(gold_ords, dtype = np.int64)
+    ocr_ords = np.asarray(ocr_ords, dtype = np.int64)
+
+    '''Compact index over only the codepoints that actually occur'''
+    codepoints, index = np.unique(np.concatenate([gold_ords, ocr_ords]), return_inverse = True)
+    index = index.reshape(-1)
+    n_codes = len(codepoints)
+    gold_index, ocr_index = index[:len(gold_ords)], index[len(gold_ords):]
+
+    pair_index = gold_index * n_codes + ocr_index
+    pairs, pair_inverse = np.unique(pair_index, return_inverse = True)
+    counts = np.bincount(pair_inverse.reshape(-1), weights = weights, minlength = len(pairs)).astype(np.int64)
+
+    return sparse_error_counts(codepoints, pairs // max(n_codes, 1), pairs % max(n_codes, 1), counts)
+
+
+def load_error_counts(fp):
+    """
+    Parameters
+    ----------
+    fp : string
+        Either a sparse .npz file written by sparse_error_counts.save, or one of the
+        older dense .npy error count arrays.
+
+    Returns
+    -------
+    sparse_error_counts
+    """
+    if fp.endswith('.npy'):
+        dense = np.load(fp)
+        rows, cols = np.nonzero(dense)
+        return accumulate_error_ords(rows, cols, weights = dense[rows, cols])
+
+    with np.load(fp) as data:
+        return sparse_error_counts(data['codepoints'], data['rows'], data['cols'], data['counts'])
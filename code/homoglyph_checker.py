@@ -6,27 +6,254 @@ Created on Thu Jul 14 12:04:20 2022
 
 This file contains methods to determine whether or not a spelling mistake
 is homoglyphic when counting errors in OCR-ed text.
+
+The homoglyph relation at the chosen sensitivity is held as a frozenset of ordered
+(ocr_chr, gold_chr) pairs, so each check is a handful of set lookups. The set can be
+precompiled into a small binary file next to the homoglyph json, which is then loaded
+instead of parsing the json (the file is named after the sensitivity and a hash of the json's
+contents, so editing the json or switching lists never picks up a stale table):
+
+    python homoglyph_checker.py <homoglyph_list.json> <sensitivity>
+
+Nothing is read at import. The table is loaded the first time an error is classified,
+from utils/homoglyph_list.json next to this file unless the HOMOGLYPH_LIST_PATH
+environment variable or configure_homoglyph_table says otherwise. To share one copy
+between pool workers, either load() it before the pool forks, or use an
+mmap_homoglyph_table, which looks pairs up straight out of the compiled binary table
+so every process reads the same OS pages.
 """
 
 
-import re
+import os
+import sys
+import mmap
+import struct
+import hashlib
+from array import array
+from bisect import bisect_left
 from homoglyph_spell_check_utils import create_homoglyph_dict
 
-homoglyph_dict = create_homoglyph_dict(sensitivity=.2, homoglyph_fp=r'C:\Users\bryan\Documents\NBER\OCR_error_correction\code\utils\homoglyph_list.json')
+HOMOGLYPH_FP = os.environ.get('HOMOGLYPH_LIST_PATH',
+                              os.path.join(os.path.dirname(os.path.abspath(__file__)), 'utils', 'homoglyph_list.json'))
+SENSITIVITY = .2
+
+'''Binary pair table layout: magic, number of pairs, sensitivity, then the sorted pairs as
+little endian uint64 keys of (ord(ocr_chr) << 32) | ord(gold_chr)'''
+PAIRS_MAGIC = b'HGP1'
+PAIRS_HEADER = struct.Struct('<4sId')
+
+
+def make_homoglyph_pairs(homoglyph_dict):
+    return frozenset((a, b) for a, alts in homoglyph_dict.items() for b in alts)
+
+
+def homoglyph_list_hash(homoglyph_fp):
+    '''Short hash of the homoglyph list's contents, for keying what's derived from it'''
+    with open(homoglyph_fp, 'rb') as infile:
+        return hashlib.sha1(infile.read()).hexdigest()[:16]
+
+
+def compiled_pairs_path(homoglyph_fp, sensitivity):
+    return os.path.splitext(homoglyph_fp)[0] + '_{}_{}.bin'.format(sensitivity, homoglyph_list_hash(homoglyph_fp))
+
+
+def _pairs_to_keys(pairs):
+    return sorted((ord(a) << 32) | ord(b) for a, b in pairs)
+
+
+def compile_homoglyph_pairs(homoglyph_fp, sensitivity, out_fp = None):
+    """
+    Parameters
+    ----------
+    homoglyph_fp : string
+        Path to the homoglyph json list.
+    sensitivity : float
+        Minimum similarity score for two characters to count as homoglyphs.
+    out_fp : string, optional
+        Where to write the table. Defaults to compiled_pairs_path(homoglyph_fp, sensitivity),
+        which is where this module looks for it.
+
+    Returns
+    -------
+    out_fp : string
+    """
+    if out_fp is None:
+        out_fp = compiled_pairs_path(homoglyph_fp, sensitivity)
+
+    keys = array('Q', _pairs_to_keys(make_homoglyph_pairs(create_homoglyph_dict(sensitivity = sensitivity,
+                                                                                homoglyph_fp = homoglyph_fp))))
+    if sys.byteorder != 'little':
+        keys.byteswap()
+
+    with open(out_fp, 'wb') as outfile:
+        outfile.write(PAIRS_HEADER.pack(PAIRS_MAGIC, len(keys), sensitivity))
+        outfile.write(keys.tobytes())
+
+    return out_fp
+
+
+def load_homoglyph_pairs(fp, sensitivity = None):
+    """
+    Parameters
+    ----------
+    fp : string
+        Binary pair table written by compile_homoglyph_pairs.
+    sensitivity : float, optional
+        If given, raises a ValueError if the table was compiled at a different sensitivity.
+
+    Returns
+    -------
+    homoglyph_pairs : frozenset of (ocr_chr, gold_chr) tuples
+    """
+    with open(fp, 'rb') as infile:
+        magic, n_pairs, file_sensitivity = PAIRS_HEADER.unpack(infile.read(PAIRS_HEADER.size))
+        if magic != PAIRS_MAGIC:
+            raise ValueError('{} is not a compiled homoglyph pair table!'.format(fp))
+        if sensitivity is not None and file_sensitivity != sensitivity:
+            raise ValueError('{} was compiled at sensitivity {}, not {}'.format(fp, file_sensitivity, sensitivity))
+
+        keys = array('Q')
+        keys.frombytes(infile.read(n_pairs * keys.itemsize))
+    if sys.byteorder != 'little':
+        keys.byteswap()
+
+    return frozenset((chr(key >> 32), chr(key & 0xFFFFFFFF)) for key in keys)
+
+
+class homoglyph_table:
+
+    def __init__(self, homoglyph_fp = HOMOGLYPH_FP, sensitivity = SENSITIVITY):
+        """
+        Parameters
+        ----------
+        homoglyph_fp : string
+            Path to the homoglyph json list. If there is a compiled pair table next to it
+            (see compiled_pairs_path) that is loaded instead of the json.
+        sensitivity : float
+            Minimum similarity score for two characters to count as homoglyphs.
+        """
+        self.homoglyph_fp = homoglyph_fp
+        self.sensitivity = sensitivity
+        self._pairs = None
+        self._list_hash = None
+
+    def load(self):
+        if self._pairs is None:
+            compiled_fp = compiled_pairs_path(self.homoglyph_fp, self.sensitivity)
+            if os.path.exists(compiled_fp):
+                self._pairs = load_homoglyph_pairs(compiled_fp, sensitivity = self.sensitivity)
+            else:
+                self._pairs = make_homoglyph_pairs(create_homoglyph_dict(sensitivity = self.sensitivity,
+                                                                         homoglyph_fp = self.homoglyph_fp))
+        return self
+
+    @property
+    def pairs(self):
+        '''Set of (ocr_chr, gold_chr) tuples, loaded on first use'''
+        return self.load()._pairs
+
+    @property
+    def list_hash(self):
+        '''homoglyph_list_hash of the json list the pairs come from'''
+        if self._list_hash is None:
+            self._list_hash = homoglyph_list_hash(self.homoglyph_fp)
+        return self._list_hash
+
+
+class mmap_homoglyph_table:
+
+    def __init__(self, compiled_fp, sensitivity = None):
+        """
+        Parameters
+        ----------
+        compiled_fp : string
+            Binary pair table written by compile_homoglyph_pairs.
+        sensitivity : float, optional
+            If given, raises a ValueError on load if the table was compiled at a different sensitivity.
+        """
+        if sys.byteorder != 'little':
+            raise ValueError('mmap_homoglyph_table needs a little endian machine, use homoglyph_table instead')
+        self.compiled_fp = compiled_fp
+        self.sensitivity = sensitivity
+        self._keys = None
+        self._list_hash = None
+
+    def load(self):
+        if self._keys is None:
+            with open(self.compiled_fp, 'rb') as infile:
+                self._mmap = mmap.mmap(infile.fileno(), 0, access = mmap.ACCESS_READ)
+            magic, n_pairs, file_sensitivity = PAIRS_HEADER.unpack_from(self._mmap)
+            if magic != PAIRS_MAGIC:
+                raise ValueError('{} is not a compiled homoglyph pair table!'.format(self.compiled_fp))
+            if self.sensitivity is not None and file_sensitivity != self.sensitivity:
+                raise ValueError('{} was compiled at sensitivity {}, not {}'.format(self.compiled_fp,
+                                                                                      file_sensitivity, self.sensitivity))
+            self.sensitivity = file_sensitivity
+            self._keys = memoryview(self._mmap)[PAIRS_HEADER.size:PAIRS_HEADER.size + 8 * n_pairs].cast('Q')
+        return self
+
+    @property
+    def pairs(self):
+        return self.load()
+
+    @property
+    def list_hash(self):
+        '''homoglyph_list_hash of the compiled table itself, which may not sit next to its json list'''
+        if self._list_hash is None:
+            self._list_hash = homoglyph_list_hash(self.compiled_fp)
+        return self._list_hash
+
+    def __contains__(self, pair):
+        '''Binary search over the sorted pair keys, read straight out of the mapped file'''
+        self.load()
+        key = (ord(pair[0]) << 32) | ord(pair[1])
+        i = bisect_left(self._keys, key)
+        return i < len(self._keys) and self._keys[i] == key
+
+    def __getstate__(self):
+        '''The mapping can't be pickled, each process maps the file again on first use'''
+        return {'compiled_fp': self.compiled_fp, 'sensitivity': self.sensitivity, '_keys': None,
+                '_list_hash': self._list_hash}
+
+
+_table = homoglyph_table()
+
+def configure_homoglyph_table(homoglyph_fp = HOMOGLYPH_FP, sensitivity = SENSITIVITY, use_mmap = False):
+    """
+    Sets the table is_error_homoglyphic uses. Nothing is read until the first lookup.
+
+    With use_mmap, the compiled pair table for homoglyph_fp/sensitivity is mapped instead
+    of loaded, after compiling it if it doesn't exist yet.
+    """
+    global _table
+    if use_mmap:
+        compiled_fp = compiled_pairs_path(homoglyph_fp, sensitivity)
+        if not os.path.exists(compiled_fp):
+            compile_homoglyph_pairs(homoglyph_fp, sensitivity, out_fp = compiled_fp)
+        _table = mmap_homoglyph_table(compiled_fp, sensitivity = sensitivity)
+    else:
+        _table = homoglyph_table(homoglyph_fp, sensitivity)
+    return _table
+
+def get_homoglyph_table():
+    return _table
+
 
 def is_error_homoglyphic(ocr, gold):
     '''Strip out spaces, don't want to consider them'''
-    ocr = re.sub(' ', '', ocr)
-    gold = re.sub(' ', '', gold)
+    ocr = ocr.replace(' ', '')
+    gold = gold.replace(' ', '')
 
     if len(ocr) > 3 or len(gold) > 3:
         return 'nonhomoglyph'
     else:
+        homoglyph_pairs = _table.pairs
         for ch_ocr in ocr:
             for ch_gold in gold:
-                try:
-                    if ch_gold in homoglyph_dict[ch_ocr]:
-                        return 'homoglyph'
-                except KeyError:
-                    pass
-    return 'nonhomoglyph'
\ No newline at end of file
+                if (ch_ocr, ch_gold) in homoglyph_pairs:
+                    return 'homoglyph'
+    return 'nonhomoglyph'
+
+
+if __name__ == '__main__':
+    print(compile_homoglyph_pairs(sys.argv[1], float(sys.argv[2])))
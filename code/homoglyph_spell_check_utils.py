@@ -5,7 +5,11 @@ from symspellpy import SymSpell
 import editdistance
 import os
 import json
-from collections import defaultdict
+import numpy as np
+from itertools import islice
+from collections import defaultdict, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from symspell_artifact import load_symspell_artifact
 
 
 def create_common_abbrev():
@@ -15,12 +19,16 @@ def create_common_abbrev():
     ])
 
 
-def create_worddict():
-    sym_spell = SymSpell()
-    dictionary_path = pkg_resources.resource_filename("symspellpy", "frequency_dictionary_en_82_765.txt")
-    sym_spell.load_dictionary(dictionary_path, 0, 1)
+def create_worddict(artifact_path = None):
+    # a prebuilt symspell_artifact skips building symspell's deletes just to get at the word counts
+    if artifact_path is not None:
+        worddict = dict(load_symspell_artifact(artifact_path).words)
+    else:
+        sym_spell = SymSpell()
+        dictionary_path = pkg_resources.resource_filename("symspellpy", "frequency_dictionary_en_82_765.txt")
+        sym_spell.load_dictionary(dictionary_path, 0, 1)
+        worddict = sym_spell.words
     abbrevs = [depunctuate(a) for a in create_common_abbrev()]
-    worddict = sym_spell.words
     for a in abbrevs:
         if a in worddict:
             del worddict[a]
@@ -147,6 +155,120 @@ def is_abbrev(s, abbrevset):
     return s.lower() in abbrevset
 
 
+DEPUNCTUATE_CHARS = frozenset(',.?!$%&():;-"')
+
+
+class homoglyph_word_index:
+
+    def __init__(self, worddict, vsim_dict):
+        """
+        Index for finding the dictionary words a misspelling can be turned into with homoglyph
+        substitutions, without building candidate strings one substitution at a time.
+
+        Every prefix of every dictionary word goes into a set. visual_spell_checker then walks
+        the word once, trying each character's homoglyphs against that set, so a substitution
+        is only followed up while some dictionary word still starts with what's been built so
+        far. A punctuation mark in the word is dropped, since is_word depunctuates, but a letter
+        is never swapped for a punctuation homoglyph, which would delete it from the word.
+        Results are memoized per (position, prefix), so every reachable dictionary word is
+        found (no beam needed), and the highest frequency one wins.
+
+        The beam in visual_spell_checker runs out before reaching many of these words, so the
+        index's corrections are not the same as the beam's; vs_checker only uses it when asked.
+
+        Parameters
+        ----------
+        worddict : dict
+            word : frequency, as made by create_worddict.
+        vsim_dict : dict
+            character : list of homoglyphs, as made by create_homoglyph_dict.
+        """
+        self.worddict = worddict
+        self.vsim_dict = vsim_dict
+        self.prefixes = {word[:i] for word in worddict for i in range(len(word) + 1)}
+        self._options = {}
+
+    def options(self, c):
+        '''(lowercased character or '' if depunctuated away, character substituted in) for c and its homoglyphs'''
+        if c not in self._options:
+            options = {}
+            for alt in [c] + list(self.vsim_dict.get(c, ())):
+                if alt not in DEPUNCTUATE_CHARS:
+                    options.setdefault(alt.lower(), alt)
+                elif c in DEPUNCTUATE_CHARS:
+                    options.setdefault('', alt)
+            self._options[c] = list(options.items())
+        return self._options[c]
+
+    def _search(self, w, i, prefix, memo):
+        if i == len(w):
+            return (self.worddict[prefix], '') if prefix in self.worddict else None
+
+        key = (i, prefix)
+        if key not in memo:
+            best = None
+            for ch, alt in self.options(w[i]):
+                if prefix + ch in self.prefixes:
+                    found = self._search(w, i + 1, prefix + ch, memo)
+                    if found is not None and (best is None or found[0] > best[0]):
+                        best = (found[0], alt + found[1])
+            memo[key] = best
+        return memo[key]
+
+    def lookup_word(self, w):
+        '''w with the substitutions that make the highest frequency dictionary word, or None'''
+        found = self._search(w, 0, '', {})
+        return found[1] if found is not None else None
+
+    def _substitute(self, w, target):
+        '''w with homoglyph substitutions so that it lowercases to target, or None'''
+        if len(w) != len(target):
+            return None
+        out = []
+        for c, t in zip(w, target):
+            if c.lower() == t:
+                out.append(c)
+            else:
+                alt = next((alt for alt in self.vsim_dict.get(c, ()) if alt.lower() == t), None)
+                if alt is None:
+                    return None
+                out.append(alt)
+        return ''.join(out)
+
+    def correct(self, w, abbrevset):
+        """
+        Same preference order as visual_spell_checker: the highest frequency dictionary word,
+        then an abbreviation, then an initial, then a number. Returns w if none can be made.
+        """
+        word = self.lookup_word(w)
+        if word is not None:
+            return word
+
+        for abbrev in sorted(abbrevset):
+            abbrev = self._substitute(w, abbrev)
+            if abbrev is not None:
+                return abbrev
+
+        if len(w) == 2:
+            first = w[0] if w[0].isupper() and w[0].isalpha() else \
+                        next((alt for alt in self.vsim_dict.get(w[0], ()) if alt.isupper() and alt.isalpha()), None)
+            if first is not None and (w[1] == '.' or '.' in self.vsim_dict.get(w[1], ())):
+                return first + '.'
+
+        number = []
+        for c in w:
+            if c in DEPUNCTUATE_CHARS or c.isdigit():
+                number.append(c)
+            else:
+                alt = next((alt for alt in self.vsim_dict.get(c, ()) if alt.isdigit()), None) or \
+                        next((alt for alt in self.vsim_dict.get(c, ()) if alt in DEPUNCTUATE_CHARS), None)
+                if alt is None:
+                    return w
+                number.append(alt)
+        number = ''.join(number)
+        return number if is_number(number) else w
+
+
 def visual_spell_checker(
         textline,
         worddict,
@@ -154,9 +276,13 @@ def visual_spell_checker(
         abbrevset,
         beam=1000,
         splitter_pattern=r"( |/|-|\"|')",
-        majority_norm=True
+        majority_norm=True,
+        index=None,
+        cache=None
     ):
 
+    # with a homoglyph_word_index, corrections are looked up instead of built up with the beam
+    # with a correction_cache, each distinct misspelling is only corrected once
     # final list to return
     splitters = splitter_pattern[1:-1].split("|")
     spell_checked_words = []
@@ -170,6 +296,17 @@ def visual_spell_checker(
             # check if word or number
             if not is_word(w, worddict) and not is_number(w) and not all_caps(w):
 
+                correction = cache.get(w) if cache is not None else None
+                if correction is not None:
+                    spell_checked_words.append(correction)
+                    continue
+
+                if index is not None:
+                    spell_checked_words.append(index.correct(w, abbrevset))
+                    if cache is not None:
+                        cache.put(w, spell_checked_words[-1])
+                    continue
+
                 # if not, create list of candidate words to check iteratively
                 candidate_words = [w]
 
@@ -226,6 +363,9 @@ def visual_spell_checker(
                 else:
                     spell_checked_words.append(w)
 
+                if cache is not None:
+                    cache.put(w, spell_checked_words[-1])
+
             # if word found with no substitution needed, add it and move on
             else:
                 spell_checked_words.append(w)
@@ -266,12 +406,7 @@ def textline_evaluation(
 
     for gt, pred in pairs:
 
-        # eval w/o spaces
-        pred, gt = string_cleaner(pred), string_cleaner(gt)
-        gt = gt.strip() if not no_spaces_in_eval else gt.strip().replace(" ", "")
-        pred = pred.strip() if not no_spaces_in_eval else pred.strip().replace(" ", "")
-        if uncased:
-            pred, gt = pred.lower(), gt.lower()
+        gt, pred = _clean_eval_pair(gt, pred, no_spaces_in_eval, uncased)
 
         # textline accuracy
         if pred == gt:
@@ -295,4 +430,103 @@ def textline_evaluation(
     else:
         cer = edit_count / n_chars
 
-    return accuracy, cer
\ No newline at end of file
+    return accuracy, cer
+
+
+def _clean_eval_pair(gt, pred, no_spaces_in_eval=False, uncased=False):
+    # eval w/o spaces
+    pred, gt = string_cleaner(pred), string_cleaner(gt)
+    gt = gt.strip() if not no_spaces_in_eval else gt.strip().replace(" ", "")
+    pred = pred.strip() if not no_spaces_in_eval else pred.strip().replace(" ", "")
+    if uncased:
+        pred, gt = pred.lower(), gt.lower()
+    return gt, pred
+
+
+# per pair results of textline_evaluation_batch, each a numpy array with one entry per pair
+textline_scores = namedtuple('textline_scores', ['distances', 'gt_lengths', 'pred_lengths', 'n_chars', 'correct'])
+
+
+def _evaluate_chunk(args):
+    pairs, no_spaces_in_eval, uncased = args
+    distances, gt_lengths, pred_lengths, n_chars, correct = [], [], [], [], []
+    for gt, pred in pairs:
+        n_chars.append(len(gt))
+        gt, pred = _clean_eval_pair(gt, pred, no_spaces_in_eval, uncased)
+        distances.append(editdistance.eval(pred, gt))
+        gt_lengths.append(len(gt))
+        pred_lengths.append(len(pred))
+        correct.append(pred == gt)
+    return distances, gt_lengths, pred_lengths, n_chars, correct
+
+
+def textline_evaluation_batch(
+        pairs,
+        no_spaces_in_eval=False,
+        norm_edit_distance=False,
+        uncased=False,
+        workers=1,
+        chunksize=10000
+    ):
+    """
+    Same accuracy and CER as textline_evaluation, but also returns the per pair results as
+    numpy arrays (a textline_scores), so breakdowns by scan, paper etc. (see group_scores)
+    need no second pass over the text. The cleaning and edit distances are done chunksize
+    pairs at a time, across a pool of worker processes if workers > 1.
+
+    With norm_edit_distance, a pair that is empty on both sides counts as distance 0
+    (textline_evaluation divides by zero on it). A ValueError is raised if there are no pairs,
+    or, without norm_edit_distance, no ground truth characters to take the CER over.
+    """
+    pairs = iter(pairs)
+    chunks = iter(lambda: list(islice(pairs, chunksize)), [])
+    jobs = ((chunk, no_spaces_in_eval, uncased) for chunk in chunks)
+
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(_evaluate_chunk, jobs))
+    else:
+        results = [_evaluate_chunk(job) for job in jobs]
+
+    columns = [np.fromiter((x for result in results for x in result[i]), dtype=dtype)
+               for i, dtype in enumerate([np.int64, np.int64, np.int64, np.int64, bool])]
+    scores = textline_scores(*columns)
+
+    if len(scores.correct) == 0:
+        raise ValueError('No textline pairs to evaluate!')
+    n_chars = int(scores.n_chars.sum())
+    if n_chars == 0 and not norm_edit_distance:
+        raise ValueError('The ground truth textlines are all empty, so the CER is undefined!')
+
+    accuracy = float(scores.correct.mean()) * 100
+    if norm_edit_distance:
+        # ICDAR2019 Normalized Edit Distance
+        cer = float((scores.distances / np.maximum(np.maximum(scores.gt_lengths, scores.pred_lengths), 1)).mean())
+    else:
+        cer = float(scores.distances.sum() / n_chars)
+
+    return accuracy, cer, scores
+
+
+def group_scores(scores, groups):
+    """
+    Parameters
+    ----------
+    scores : textline_scores
+        From textline_evaluation_batch.
+    groups : array like
+        Group of each pair, e.g. its scan or paper id.
+
+    Returns
+    -------
+    labels : numpy array of the distinct groups
+    accuracy : numpy array, textline accuracy (%) of each group
+    cer : numpy array, CER of each group (summed distances over summed ground truth characters)
+    """
+    labels, index = np.unique(np.asarray(groups), return_inverse=True)
+    index = index.reshape(-1)
+    n_lines = np.bincount(index, minlength=len(labels))
+    accuracy = np.bincount(index, weights=scores.correct, minlength=len(labels)) / n_lines * 100
+    cer = np.bincount(index, weights=scores.distances, minlength=len(labels)) / \
+            np.bincount(index, weights=scores.n_chars, minlength=len(labels))
+    return labels, accuracy, cer
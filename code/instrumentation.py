@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""
+Opt-in timing of align_json_texts (align_json_texts(..., profile = True)), to find out
+where the wall clock goes on a run and which articles are responsible for it.
+
+A stage_profiler adds up the seconds spent in each stage (loading, cleaning, sanitizing,
+the catastrophic checks, alignment cache lookups, aligning, writing), keeps the deepest recursion iter_alignment
+reached, and keeps the slowest N articles with their lengths on a heap, so pathological
+inputs can be pulled out and looked at. A disabled profiler does nothing, so the
+instrumented code doesn't need to check whether it's on.
+"""
+
+import time
+import heapq
+from contextlib import contextmanager
+from collections import namedtuple
+
+'''Order stages are reported in, any others come after'''
+STAGES = ('load', 'clean', 'sanitize', 'catastrophic_check', 'cache', 'align', 'write')
+
+'''Per article timings, made where the article is aligned (possibly in a worker process): times maps
+stage -> seconds, depth is the deepest recursion in the alignment and gold_chars the sanitized gold length'''
+article_profile = namedtuple('article_profile', ['times', 'depth', 'gold_chars'])
+
+slow_article = namedtuple('slow_article', ['seconds', 'method', 'text_id', 'ocr_chars', 'gold_chars', 'depth'])
+
+
+class stage_profiler:
+
+    def __init__(self, enabled = True, slowest_n = 10):
+        """
+        Parameters
+        ----------
+        enabled : bool
+            A disabled profiler records nothing.
+        slowest_n : int
+            Number of slowest articles to keep.
+        """
+        self.enabled = enabled
+        self.slowest_n = slowest_n
+        self.times = {}
+        self.calls = {}
+        self.max_depth = 0
+        self.total_chars = 0
+        self.articles = 0
+        self.slowest = []
+
+    def add(self, stage, seconds, calls = 1):
+        if self.enabled:
+            self.times[stage] = self.times.get(stage, 0) + seconds
+            self.calls[stage] = self.calls.get(stage, 0) + calls
+
+    @contextmanager
+    def stage(self, name):
+        '''Times the body of a with block as stage name'''
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def timed_call(self, name, function, *args):
+        '''function(*args), timed as stage name'''
+        if not self.enabled:
+            return function(*args)
+        start = time.perf_counter()
+        result = function(*args)
+        self.add(name, time.perf_counter() - start)
+        return result
+
+    def timed_iter(self, name, iterable):
+        '''Yields from iterable, timing how long each item takes to come out of it as stage name'''
+        if not self.enabled:
+            yield from iterable
+            return
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.add(name, time.perf_counter() - start, calls = 0)
+                return
+            self.add(name, time.perf_counter() - start)
+            yield item
+
+    def record_article(self, method, text_id, ocr_chars, profile):
+        """
+        Parameters
+        ----------
+        method : string
+            Spellchecking method the article was corrected with ('' for none).
+        text_id : int
+        ocr_chars : int
+            Length of the sanitized OCR text.
+        profile : article_profile
+        """
+        if not self.enabled:
+            return
+        for stage, seconds in profile.times.items():
+            self.add(stage, seconds)
+        self.max_depth = max(self.max_depth, profile.depth)
+        self.total_chars += ocr_chars
+        self.articles += 1
+
+        article = slow_article(sum(profile.times.values()), method, text_id, ocr_chars, profile.gold_chars,
+                               profile.depth)
+        if len(self.slowest) < self.slowest_n:
+            heapq.heappush(self.slowest, article)
+        elif self.slowest_n > 0:
+            heapq.heappushpop(self.slowest, article)
+
+    def report(self):
+        if not self.enabled:
+            return
+        total = sum(self.times.values())
+        print('profile: {} articles, {} characters, max alignment recursion depth {}'.format(
+                            self.articles, self.total_chars, self.max_depth))
+        for stage in sorted(self.times, key = lambda s: (STAGES.index(s) if s in STAGES else len(STAGES), s)):
+            print('  {:<20} {:10.3f}s {:6.1%}  ({} calls)'.format(stage, self.times[stage],
+                            self.times[stage] / total if total > 0 else 0, self.calls[stage]))
+        if self.times.get('align', 0) > 0:
+            print('  {:,.0f} characters aligned/s'.format(self.total_chars / self.times['align']))
+
+        print('slowest {} articles:'.format(len(self.slowest)))
+        for article in sorted(self.slowest, reverse = True):
+            print('  {:10.3f}s  id {}  method {!r}  {} ocr / {} gold chars  depth {}'.format(
+                            article.seconds, article.text_id, article.method, article.ocr_chars,
+                            article.gold_chars, article.depth))
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+"""
+Incremental readers for the two json layouts used throughout the toolkit, so a
+multi-GB corpus file never has to be json.load-ed (and held as one string plus
+one big dict) all at once.
+
+    iter_ocr_articles(filepath) - OCR/spellchecked files in the format
+        {scan1_id: {article1_id: <article1_text>, ...}, scan2_id: {...}, ...}
+        yields (scan_id, article_id, text) records one article at a time
+
+    iter_gold_annotations(filepath) - gold COCO files, yields (annotation id, text)
+        pairs one annotation at a time. Everything outside of 'annotations' is skipped.
+
+Only the standard library json decoder is used. The file is read in chunks and only
+the structure around the records is parsed by hand; each record (an article string or
+a single annotation) is decoded with json.JSONDecoder.raw_decode, so peak memory is
+bounded by the largest single record rather than the whole file.
+"""
+
+import json
+import re
+
+CHUNK_SIZE = 1 << 20
+
+_non_whitespace = re.compile(r'\S')
+
+
+class _json_stream:
+
+    def __init__(self, infile, chunk_size = CHUNK_SIZE):
+        self.infile = infile
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self, min_size = 0):
+        '''Reads in at least another chunk, dropping whatever has already been consumed'''
+        chunk = self.infile.read(max(self.chunk_size, min_size))
+        if len(chunk) == 0:
+            self.eof = True
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+
+    def peek(self):
+        '''Next non-whitespace character ('' at the end of the file), without consuming it'''
+        while True:
+            match = _non_whitespace.search(self.buf, self.pos)
+            if match is not None:
+                self.pos = match.start()
+                return self.buf[self.pos]
+            self.pos = len(self.buf)
+            if self.eof:
+                return ''
+            self._fill()
+
+    def expect(self, chars):
+        ch = self.peek()
+        if ch == '' or ch not in chars:
+            raise ValueError('Malformed json: expected one of {} at character {} of buffer, found {}'.format(
+                                  repr(chars), self.pos, repr(ch)))
+        self.pos += 1
+        return ch
+
+    def decode(self):
+        '''Decodes the next json value in full'''
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+                #A number running into the end of the buffer might continue in the next chunk
+                if end < len(self.buf) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            #Value is cut off by the end of the buffer--grow it geometrically so this stays linear
+            self._fill(min_size = len(self.buf) - self.pos)
+
+    def iter_object(self):
+        '''Walks the members of a json object, yielding keys. The caller must consume each value.'''
+        self.expect('{')
+        if self.peek() == '}':
+            self.pos += 1
+            return
+        while True:
+            key = self.decode()
+            self.expect(':')
+            yield key
+            if self.expect(',}') == '}':
+                return
+
+    def iter_array(self):
+        '''Walks the elements of a json array, yielding each one decoded'''
+        self.expect('[')
+        if self.peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            yield self.decode()
+            if self.expect(',]') == ']':
+                return
+
+
+def iter_ocr_articles(filepath):
+    """
+    Parameters
+    ----------
+    filepath : string
+        Path to a json file in the format
+            {scan1_id: {article1_id: <article1_text>, ...}, ...}
+
+    Yields
+    ------
+    (scan_id, article_id, text) : tuple of strings, in file order
+    """
+    with open(filepath, 'r') as infile:
+        stream = _json_stream(infile)
+        for scan_id in stream.iter_object():
+            for article_id in stream.iter_object():
+                yield scan_id, article_id, stream.decode()
+
+
+def iter_gold_annotations(filepath):
+    """
+    Parameters
+    ----------
+    filepath : string
+        Path to a gold json/coco file with an 'annotations' list, each annotation
+        having at least an 'id' and 'text'.
+
+    Yields
+    ------
+    (annotation_id, text) : (int, string) pairs, in file order
+    """
+    with open(filepath, 'r') as infile:
+        stream = _json_stream(infile)
+        for key in stream.iter_object():
+            if key == 'annotations':
+                for anno in stream.iter_array():
+                    yield int(anno['id']), anno['text']
+            else:
+                stream.decode()
@@ -19,31 +19,58 @@ Where the ocr_filepath.json file has to have the format:
      }
 """
 
+import os
+import copy
 import json
 import time
 import pkg_resources
+from abc import ABC, abstractmethod
+from concurrent.futures import ProcessPoolExecutor
 from tqdm import tqdm
 from difflib import SequenceMatcher
 
 # from neuspell import BertChecker, CnnlstmChecker, SclstmChecker
 from symspellpy import SymSpell, Verbosity
-from homoglyph_spell_check_utils import create_common_abbrev, create_worddict, create_homoglyph_dict, visual_spell_checker
+from homoglyph_checker import HOMOGLYPH_FP, homoglyph_list_hash
+from homoglyph_spell_check_utils import create_common_abbrev, create_worddict, create_homoglyph_dict, visual_spell_checker, \
+                                        homoglyph_word_index
 import contextualSpellCheck
 import spacy
-from align_texts import clean_ocr_text
+from align_json_texts import clean_ocr_text
+from json_stream import iter_ocr_articles
+from correction_cache import correction_cache
+from checker_server import checker_client
+from symspell_artifact import load_symspell_artifact
+from spellcheck_checkpoint import spellcheck_checkpoint
 
-class spellcheck:
+class spellcheck(ABC):
 
     preprocessing_methods = {'align_cleaning': clean_ocr_text}
 
+    #Repeated articles or sentences (mastheads, ads, boilerplate...) are only sent to the checker once,
+    # their correction being remembered for up to dedup_cache_size distinct ones (0 turns this off).
+    # Which of the two is up to the checker, see sentence_spellcheck and spacy_checker
+    dedup_cache_size = 100000
+    dedup_unit = 'article'
+
     def __init__(self, filepath, preprocessing = None):
-        with open(filepath, 'r') as infile:
-            self.ocr_dict = json.load(infile)
+        #Streamed in article by article, so the raw file contents are never held alongside the dict
+        #No filepath makes a checker with no articles of its own, e.g. one held by a checker_server
+        self.ocr_dict = {}
+        if filepath is not None:
+            for scan, k, article in iter_ocr_articles(filepath):
+                self.ocr_dict.setdefault(scan, {})[k] = article
 
         self.load_time = 0
         self.run_time = 0
         self.checked_dict = None
-        self.outpath = filepath[:-5]
+        self.correction_cache = None
+        self.shard_size = 64
+        self.worker_times = {}
+        self.checkpoint = None
+        self.checked_keys = set()
+        self.dedup_cache = correction_cache(self.dedup_cache_size)
+        self.outpath = filepath[:-5] if filepath is not None else ''
         self.preprocessing = preprocessing
 
         if self.preprocessing is not None:
@@ -52,21 +79,190 @@ class spellcheck:
     def _preprocess(self):
         self.ocr_dict = self.preprocessing_methods[self.preprocessing](self.ocr_dict)
 
-    def spellcheck(self):
-
-        loadin_start = time.time()
-        self._load_checker()
-        self.load_time = time.time() - loadin_start
+    def spellcheck(self, workers = 1, shard_size = 64, server = None, checkpoint = False):
+        """
+        Parameters
+        ----------
+        workers : int
+            Number of worker processes. Each loads its own checker once and is then sent shards
+            of articles, so the corrections are the same as with workers = 1.
+        shard_size : int
+            Number of articles per shard, which is also the batch size for checkers that
+            correct several articles at once.
+        server : string, optional
+            Socket path of a running checker_server (see checker_server.py). The shards are sent
+            there to be corrected by an already loaded checker instead of loading one here.
+        checkpoint : bool
+            Save each shard as soon as it's corrected (see spellcheck_checkpoint.py), in
+            <outpath>_checkpoint next to the output. Running again with checkpoint = True after
+            a crash picks up where it stopped, only checking the articles not on file yet.
+        """
+        self.shard_size = shard_size
+        if checkpoint:
+            self._resume()
+
+        if server is not None:
+            run_start = time.time()
+            self._run_on_server(server)
+            self.run_time = time.time() - run_start
+            return
+
+        if workers > 1:
+            run_start = time.time()
+            self._run_parallel(workers)
+            self.run_time = time.time() - run_start
+            self.load_time = max((times[0] for times in self.worker_times.values()), default = 0)
+        else:
+            loadin_start = time.time()
+            self._load_checker()
+            self.load_time = time.time() - loadin_start
+
+            run_start = time.time()
+            self._run_checker()
+            self.run_time = time.time() - run_start
+
+        if self.correction_cache is not None and self.correction_cache.path is not None:
+            self.correction_cache.save()
+
+    def _make_correction_cache(self):
+        '''The correction_cache the checker memoizes its corrections in, if it uses one'''
+        return None
+
+    @abstractmethod
+    def _correct_article(self, article):
+        '''The corrected text of a single non-empty article'''
+
+    def _correct_articles(self, articles):
+        '''Corrects a batch of non-empty articles. Checkers that can do a whole batch at once override this'''
+        corrected = []
+        for article in articles:
+            try:
+                corrected.append(self._correct_article(article))
+            except ValueError:
+                print(article)
+                corrected.append('')
+        return corrected
+
+    def _check_articles(self, articles):
+        corrected = iter(self._correct_articles([article for article in articles if len(article) > 0]))
+        return [next(corrected) if len(article) > 0 else '' for article in articles]
+
+    def _resume(self):
+        '''Puts the articles already in the checkpoint back into ocr_dict, so _shards leaves them out'''
+        self.checkpoint = spellcheck_checkpoint(self.outpath[:-5] + '_checkpoint',
+                                                config = [type(self).__name__, self.server_options()])
+        for (scan, k), article in self.checkpoint.load().items():
+            if k in self.ocr_dict.get(scan, {}):
+                self.ocr_dict[scan][k] = article
+                self.checked_keys.add((scan, k))
+
+    def _shards(self):
+        '''Lists of (scan, article_id) keys of ocr_dict still to be checked, shard_size at a time'''
+        keys = [(scan, k) for scan in self.ocr_dict for k in self.ocr_dict[scan] if (scan, k) not in self.checked_keys]
+        return [keys[i:i + self.shard_size] for i in range(0, len(keys), self.shard_size)]
+
+    def _finish_shard(self, shard, corrected):
+        for (scan, k), article in zip(shard, corrected):
+            self.ocr_dict[scan][k] = article
+        if self.checkpoint is not None:
+            self.checkpoint.append(shard, corrected)
 
-        run_start = time.time()
-        self._run_checker()
-        self.run_time = time.time() - run_start
+    def _run_checker(self):
+        for shard in tqdm(self._shards()):
+            self._finish_shard(shard, self._check_articles([self.ocr_dict[scan][k] for scan, k in shard]))
+
+    def _run_parallel(self, workers):
+        '''Each worker gets a copy of this checker without the articles and loads it once. The corrections
+        the workers add to their correction caches are sent back with each shard and merged into this
+        checker's, which spellcheck then saves'''
+        self.correction_cache = self._make_correction_cache()
+        worker_copy = copy.copy(self)
+        worker_copy.correction_cache = None
+        worker_copy.ocr_dict = {}
+        worker_copy.checkpoint = None
+        worker_copy.checked_keys = set()
+
+        self.worker_times = {}
+        shards = self._shards()
+        with ProcessPoolExecutor(max_workers = workers, initializer = _init_spellcheck_worker,
+                                 initargs = (worker_copy,)) as pool:
+            futures = [pool.submit(_check_shard, [self.ocr_dict[scan][k] for scan, k in shard]) for shard in shards]
+            for shard, future in zip(shards, tqdm(futures)):
+                corrected, pid, load_time, run_time, (dedup_hits, dedup_misses), cache_update = future.result()
+                self._finish_shard(shard, corrected)
+                self.dedup_cache.hits += dedup_hits
+                self.dedup_cache.misses += dedup_misses
+                if cache_update is not None and self.correction_cache is not None:
+                    new_entries, hits, misses = cache_update
+                    for token, correction in new_entries:
+                        self.correction_cache.put(token, correction)
+                    self.correction_cache.hits += hits
+                    self.correction_cache.misses += misses
+
+                times = self.worker_times.setdefault(pid, [load_time, 0])
+                times[1] += run_time
+
+    def server_options(self):
+        '''Keyword arguments to construct the same checker with on a checker_server'''
+        return {}
+
+    def _run_on_server(self, server):
+        client = checker_client(server)
+        try:
+            self.load_time = 0
+            for shard in tqdm(self._shards()):
+                corrected, load_time = client.correct(type(self).__name__,
+                                                      [self.ocr_dict[scan][k] for scan, k in shard],
+                                                      **self.server_options())
+                self.load_time += load_time
+                self._finish_shard(shard, corrected)
+        finally:
+            client.close()
 
     def write_results(self):
-        with open(self.outpath, 'w') as outfile:
-            json.dump(self.ocr_dict, outfile)
+        #A checkpointed run is only merged into the output (and its checkpoint removed) now that it's finished
+        if self.checkpoint is not None:
+            self.checkpoint.merge(self.outpath, self.ocr_dict)
+        else:
+            with open(self.outpath, 'w') as outfile:
+                json.dump(self.ocr_dict, outfile)
         print('load time: {}'.format(self.load_time))
         print('run time: {}'.format(self.run_time))
+        for pid, (load_time, run_time) in sorted(self.worker_times.items()):
+            print('worker {} load time: {} run time: {}'.format(pid, load_time, run_time))
+        if self.correction_cache is not None:
+            self.correction_cache.report()
+        self.dedup_report()
+
+    def dedup_report(self):
+        '''How many of the sentences (or articles) checked were repeats, so never reached the checker.
+        Counted by the process doing the checking: runs on a checker_server are reported there'''
+        checked = self.dedup_cache.hits + self.dedup_cache.misses
+        if checked == 0:
+            return
+        print('dedup: {} {}s checked, {} sent to the checker ({:.2f}x dedup ratio), {} checker calls saved'.format(
+              checked, self.dedup_unit, self.dedup_cache.misses, checked / max(self.dedup_cache.misses, 1),
+              self.dedup_cache.hits))
+
+
+class sentence_spellcheck(spellcheck):
+    '''Checkers that split articles up into sentences and correct them one at a time, repeated
+    sentences only being corrected once'''
+
+    dedup_unit = 'sentence'
+
+    @abstractmethod
+    def _correct_sentence(self, sentence):
+        '''The corrected text of a single sentence'''
+
+    def _sentence_key(self, sentence):
+        '''What sentences are deduplicated on. The checker is handed the key itself, so a key may only
+        leave out what the checker ignores anyway (by default nothing: repeats have to be exact)'''
+        return sentence
+
+    def _check_sentence(self, sentence):
+        '''_correct_sentence, but only called once for every distinct _sentence_key'''
+        return self.dedup_cache.lookup(self._sentence_key(sentence), self._correct_sentence)
 
 
 # class neuspell_checker(spellcheck):
@@ -133,72 +329,80 @@ class spellcheck:
 #             return self._attach_string_chunk(corrected, final_chunk)
 
 
-class symspell_checker(spellcheck):
-    def __init__(self, filepath):
+class symspell_checker(sentence_spellcheck):
+    def __init__(self, filepath, correction_cache_path = None, correction_cache_size = 100000,
+                 dictionary_artifact = None):
         super().__init__(filepath)
         self.outpath += '_symspell.json'
+        self.correction_cache_path = correction_cache_path
+        self.correction_cache_size = correction_cache_size
+        #Prebuilt, memory mapped dictionaries from symspell_artifact.py, loaded in milliseconds
+        self.dictionary_artifact = dictionary_artifact
 
     def _load_checker(self):
-        self.checker = SymSpell()
-        dictionary_path = pkg_resources.resource_filename(
-            'symspellpy', 'frequency_dictionary_en_82_765.txt'
-        )
-        self.checker.load_dictionary(dictionary_path, 0, 1)
-
-        dictionary_path = pkg_resources.resource_filename(
-            "symspellpy", "frequency_bigramdictionary_en_243_342.txt"
-        )
-        self.checker.load_bigram_dictionary(dictionary_path, 0, 2)
-
-    def _run_checker(self):
-        for scan in self.ocr_dict.keys():
-            for k, article in self.ocr_dict[scan].items():
-                try:
-                    if len(article) > 0:
-                        sentence_corrs = []
-                        sentences = article.split('.')
-
-                        for sentence in sentences:
-                            corrs = []
-                            for input_term in sentence.split():
-                                suggestions = self.checker.lookup(input_term, Verbosity.CLOSEST, max_edit_distance=1, include_unknown=True,
-                                                                transfer_casing=True)
-                                corrs.append(suggestions[0].term)
-                            sentence_corrs.append(' '.join(corrs))
-
-                        self.ocr_dict[scan][k] = '. '.join(sentence_corrs)
-                    else:
-                        self.ocr_dict[scan][k] = ''
-                except ValueError:
-                    print(article)
-                    self.ocr_dict[scan][k] = ''
+        if self.dictionary_artifact is not None:
+            self.checker = load_symspell_artifact(self.dictionary_artifact)
+        else:
+            self.checker = SymSpell()
+            dictionary_path = pkg_resources.resource_filename(
+                'symspellpy', 'frequency_dictionary_en_82_765.txt'
+            )
+            self.checker.load_dictionary(dictionary_path, 0, 1)
+
+            dictionary_path = pkg_resources.resource_filename(
+                "symspellpy", "frequency_bigramdictionary_en_243_342.txt"
+            )
+            self.checker.load_bigram_dictionary(dictionary_path, 0, 2)
+
+        self.correction_cache = self._make_correction_cache()
+
+    def _make_correction_cache(self):
+        return correction_cache(self.correction_cache_size, self.correction_cache_path,
+                                config = ['symspell_lookup', 'frequency_dictionary_en_82_765.txt', 'closest', 1])
+
+    def server_options(self):
+        return {'correction_cache_path': self.correction_cache_path, 'correction_cache_size': self.correction_cache_size,
+                'dictionary_artifact': self.dictionary_artifact}
+
+    def _lookup_term(self, input_term):
+        suggestions = self.checker.lookup(input_term, Verbosity.CLOSEST, max_edit_distance=1, include_unknown=True,
+                                        transfer_casing=True)
+        return suggestions[0].term
+
+    def _sentence_key(self, sentence):
+        '''Sentences are corrected word by word and joined back up with single spaces, so
+        ones only differing in whitespace are repeats too'''
+        return ' '.join(sentence.split())
+
+    def _correct_sentence(self, sentence):
+        corrs = []
+        for input_term in sentence.split():
+            corrs.append(self.correction_cache.lookup(input_term, self._lookup_term))
+        return ' '.join(corrs)
+
+    def _correct_article(self, article):
+        return '. '.join([self._check_sentence(sentence) for sentence in article.split('.')])
 
 class symspell_sentence_checker(symspell_checker):
-    def __init__(self, filepath):
-        super().__init__(filepath)
+    def __init__(self, filepath, dictionary_artifact = None):
+        super().__init__(filepath, dictionary_artifact = dictionary_artifact)
 
-    def _run_checker(self):
-        for scan in self.ocr_dict.keys():
-            for k, article in self.ocr_dict[scan].items():
-                try:
-                    if len(article) > 0:
-                        sentence_corrs = []
-                        sentences = article.split('.')
+    def server_options(self):
+        return {'dictionary_artifact': self.dictionary_artifact}
 
-                        for sentence in sentences:
-                            corr = self.checker.lookup_compound(sentence, max_edit_distance=2, transfer_casing=True)[0]
-                            sentence_corrs.append(corr.term)
+    def _sentence_key(self, sentence):
+        '''lookup_compound's output can depend on the spacing, so only exact repeats count'''
+        return sentence
 
-                        self.ocr_dict[scan][k] = '. '.join(sentence_corrs)
-                    else:
-                        self.ocr_dict[scan][k] = ''
-                except ValueError:
-                    print(article)
-                    self.ocr_dict[scan][k] = ''
+    def _correct_sentence(self, sentence):
+        return self.checker.lookup_compound(sentence, max_edit_distance=2, transfer_casing=True)[0].term
 
 
 class spacy_checker(spellcheck):
 
+    #Corrects whole articles in context, so it's only whole articles that are deduplicated
+    dedup_unit = 'article'
+
     def __init__(self, filepath):
         super().__init__(filepath)
         self.outpath += '_spacy.json'
@@ -207,48 +411,103 @@ class spacy_checker(spellcheck):
         self.checker = spacy.load('en_core_web_sm')
         contextualSpellCheck.add_to_pipe(self.checker)
 
-    def _run_checker(self):
-        for scan in self.ocr_dict.keys():
-            for k, article in self.ocr_dict[scan].items():
-                try:
-                    if len(article) > 0:
-                        doc = self.checker(article)
-                        self.ocr_dict[scan][k] = doc._.outcome_spellCheck
-                    else:
-                        self.ocr_dict[scan][k] = ''
-                except ValueError:
-                    print(article)
-                    self.ocr_dict[scan][k] = ''
+    def _correct_article(self, article):
+        doc = self.checker(article)
+        return doc._.outcome_spellCheck
+
+    def _pipe_articles(self, articles):
+        '''Runs the articles through nlp.pipe, falling back to one article at a time if any of them fail'''
+        try:
+            return [doc._.outcome_spellCheck for doc in self.checker.pipe(articles, batch_size = self.shard_size)]
+        except ValueError:
+            return super()._correct_articles(articles)
+
+    def _correct_articles(self, articles):
+        '''Only the articles not seen before (in this shard or an earlier one) are piped'''
+        corrections = {}
+        for article in articles:
+            if article not in corrections:
+                corrections[article] = self.dedup_cache.get(article)
+        new = [article for article, correction in corrections.items() if correction is None]
+        for article, correction in zip(new, self._pipe_articles(new)):
+            self.dedup_cache.put(article, correction)
+            corrections[article] = correction
+        self.dedup_cache.hits += len(articles) - len(corrections)
+        return [corrections[article] for article in articles]
+
 class vs_checker:
 
-    def __init__(self, worddict, homoglyph_dict, abbrevset):
+    def __init__(self, worddict, homoglyph_dict, abbrevset, cache = None, use_index = False):
         self.worddict, self.homoglyph_dict, self.abbrevset = worddict, homoglyph_dict, abbrevset
+        #The index finds every dictionary word within reach, not just the ones the beam gets to, so its corrections differ
+        self.index = homoglyph_word_index(worddict, homoglyph_dict) if use_index else None
+        self.cache = cache
 
     def check_sentence(self, sentence):
-        return visual_spell_checker(sentence, self.worddict, self.homoglyph_dict, self.abbrevset)
+        return visual_spell_checker(sentence, self.worddict, self.homoglyph_dict, self.abbrevset, index = self.index,
+                                    cache = self.cache)
 
-class visual_homoglyph_checker(spellcheck):
+class visual_homoglyph_checker(sentence_spellcheck):
 
-    def __init__(self, filepath, homoglyphs_path = r'C:\Users\bryan\Documents\NBER\OCR_error_correction\code\utils\homoglyph_list.json', sensitivity = 0.35, preprocessing = 'align_cleaning'):
+    def __init__(self, filepath, homoglyphs_path = HOMOGLYPH_FP, sensitivity = 0.35, preprocessing = 'align_cleaning',
+                 correction_cache_path = None, correction_cache_size = 100000, dictionary_artifact = None,
+                 use_index = False):
         super().__init__(filepath)
         self.outpath += 'new_visual_homoglyph.json'
         self.homoglyphs_path = homoglyphs_path
         self.sensitivity = sensitivity
+        self.correction_cache_path = correction_cache_path
+        self.correction_cache_size = correction_cache_size
+        self.dictionary_artifact = dictionary_artifact
+        self.use_index = use_index
 
     def _load_checker(self):
-        worddict = create_worddict()
+        worddict = create_worddict(self.dictionary_artifact)
         homoglyph_dict = create_homoglyph_dict(homoglyph_fp = self.homoglyphs_path)
         abbrevset = create_common_abbrev()
-        self.checker = vs_checker(worddict, homoglyph_dict, abbrevset)
-
-    def _run_checker(self):
-        for scan in tqdm(self.ocr_dict.keys()):
-            for k, article in self.ocr_dict[scan].items():
-                try:
-                    if len(article) > 0:
-                        self.ocr_dict[scan][k] = '. '.join([self.checker.check_sentence(sentence)  for sentence in
-                                                      article.split('.') if len(sentence) > 0])
-                    else:
-                        self.ocr_dict[scan][k] = ''
-                except ValueError:
-                    self.ocr_dict[scan][k] = ''
\ No newline at end of file
+        self.correction_cache = self._make_correction_cache()
+        self.checker = vs_checker(worddict, homoglyph_dict, abbrevset, cache = self.correction_cache,
+                                  use_index = self.use_index)
+
+    def _make_correction_cache(self):
+        return correction_cache(self.correction_cache_size, self.correction_cache_path,
+                                config = ['visual_homoglyph_index' if self.use_index else 'visual_homoglyph_beam',
+                                          os.path.basename(self.homoglyphs_path), homoglyph_list_hash(self.homoglyphs_path)])
+
+    def server_options(self):
+        return {'homoglyphs_path': self.homoglyphs_path, 'sensitivity': self.sensitivity,
+                'correction_cache_path': self.correction_cache_path, 'correction_cache_size': self.correction_cache_size,
+                'dictionary_artifact': self.dictionary_artifact, 'use_index': self.use_index}
+
+    def _correct_sentence(self, sentence):
+        return self.checker.check_sentence(sentence)
+
+    def _correct_article(self, article):
+        return '. '.join([self._check_sentence(sentence) for sentence in
+                                                article.split('.') if len(sentence) > 0])
+
+
+'''Checker loaded by each spellcheck worker process'''
+_worker_checker = None
+_worker_load_time = 0
+
+def _init_spellcheck_worker(checker):
+    global _worker_checker, _worker_load_time
+    loadin_start = time.time()
+    checker._load_checker()
+    _worker_load_time = time.time() - loadin_start
+    if checker.correction_cache is not None:
+        checker.correction_cache.track_new_entries()
+    _worker_checker = checker
+
+def _check_shard(articles):
+    run_start = time.time()
+    hits, misses = _worker_checker.dedup_cache.hits, _worker_checker.dedup_cache.misses
+    cache = _worker_checker.correction_cache
+    if cache is not None:
+        cache_hits, cache_misses = cache.hits, cache.misses
+    corrected = _worker_checker._check_articles(articles)
+    cache_update = (cache.pop_new_entries(), cache.hits - cache_hits, cache.misses - cache_misses) \
+                        if cache is not None else None
+    return corrected, os.getpid(), _worker_load_time, time.time() - run_start, \
+           (_worker_checker.dedup_cache.hits - hits, _worker_checker.dedup_cache.misses - misses), cache_update
\ No newline at end of file
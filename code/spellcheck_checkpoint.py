@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+"""
+Checkpoints for long spellcheck runs. Instead of only writing the corrected articles out
+once the whole run is over, spellcheck._run_checker (and the parallel and server runners)
+hand each finished shard of articles to a spellcheck_checkpoint, which appends them to a
+JSONL file in the checkpoint directory, one {"scan", "id", "text"} record per line:
+
+    <file>_<method>_checkpoint/
+        config.json             the checker's config, see below
+        shard_<pid>.jsonl       the articles finished by the run in process <pid>
+
+Each shard is appended whole (written out in full, then fsynced) to a file opened O_APPEND,
+so a crash loses at most the shards still being corrected. Every run appends to a file of
+its own, so a record left half written by a crashed run is never continued; when loading,
+lines that don't parse are simply skipped and those articles get corrected again.
+
+Restarting with the same checkpoint directory skips every article already on file. Once
+all of them are done, merge writes the corrected articles out in the usual
+<file>_<method>.json layout align_json_texts reads (through a temporary file and
+os.replace, so the output is never left half written either) and removes the directory.
+
+Like correction_cache, a checkpoint belongs to one checker configuration: one found
+saved under a different config is discarded rather than mixed into the new run.
+"""
+
+import os
+import json
+
+
+class spellcheck_checkpoint:
+
+    def __init__(self, directory, config = None):
+        """
+        Parameters
+        ----------
+        directory : string
+            Directory holding the shard files, created on the first append.
+        config : json serializable, optional
+            Settings of the checker whose output is checkpointed.
+        """
+        self.directory = directory
+        self.config = config
+        self.path = os.path.join(directory, 'shard_{}.jsonl'.format(os.getpid()))
+        self.resumed = 0
+
+    def _shard_paths(self):
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(os.path.join(self.directory, name) for name in os.listdir(self.directory)
+                                                        if name.endswith('.jsonl'))
+
+    def load(self):
+        """
+        Returns
+        -------
+        done : dictionary
+            {(scan, article_id): corrected text} of every article already on file
+        """
+        config_path = os.path.join(self.directory, 'config.json')
+        if os.path.exists(config_path):
+            with open(config_path, 'r') as infile:
+                saved_config = json.load(infile)
+            if saved_config != json.loads(json.dumps(self.config)):
+                print('Checkpoint {} was saved with a different checker config, starting over'.format(self.directory))
+                self.clear()
+                return {}
+
+        done = {}
+        for path in self._shard_paths():
+            with open(path, 'r') as infile:
+                for line in infile:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    done[(record['scan'], record['id'])] = record['text']
+        self.resumed = len(done)
+        if self.resumed > 0:
+            print('checkpoint: resuming with {} articles already checked'.format(self.resumed))
+        return done
+
+    def append(self, keys, corrected):
+        '''Appends a finished shard of (scan, article_id) keys and their corrected texts'''
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+            with open(os.path.join(self.directory, 'config.json'), 'w') as outfile:
+                json.dump(self.config, outfile)
+
+        data = ''.join(json.dumps({'scan': scan, 'id': k, 'text': text}) + '\n'
+                                    for (scan, k), text in zip(keys, corrected)).encode('utf-8')
+        #A file object's write keeps writing until all of data is out, even if a single os.write wouldn't
+        with os.fdopen(os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644), 'ab') as outfile:
+            outfile.write(data)
+            outfile.flush()
+            os.fsync(outfile.fileno())
+
+    def merge(self, outpath, ocr_dict):
+        '''Writes the finished run's ocr_dict to outpath and removes the checkpoint'''
+        tmp_path = outpath + '.tmp'
+        with open(tmp_path, 'w') as outfile:
+            json.dump(ocr_dict, outfile)
+            outfile.flush()
+            os.fsync(outfile.fileno())
+        os.replace(tmp_path, outpath)
+        self.clear()
+
+    def clear(self):
+        for path in self._shard_paths() + [os.path.join(self.directory, 'config.json')]:
+            if os.path.exists(path):
+                os.remove(path)
+        if os.path.isdir(self.directory) and len(os.listdir(self.directory)) == 0:
+            os.rmdir(self.directory)
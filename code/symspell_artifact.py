@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+"""
+Prebuilt, memory-mapped SymSpell dictionaries. Loading frequency_dictionary_en_82_765.txt
+into SymSpell builds its deletes index from scratch (~2 million entries), which takes
+seconds in every process that spellchecks. Instead the word counts, the precomputed deletes
+and the bigram counts can be compiled once into a binary artifact:
+
+    python symspell_artifact.py <out_file> [<max_dictionary_edit_distance> <prefix_length>]
+
+load_symspell_artifact maps that file and hands SymSpell read-only views of it in place of
+its word, delete and bigram dicts, so loading takes milliseconds and the pages are shared
+between every process that maps the same file.
+
+Artifact layout (little endian): a header with the SymSpell settings, then a directory of
+(offset, length) sections. Each of the words, deletes and bigrams tables is an open
+addressing hash table on the crc32 of the utf-8 key:
+
+    slots       - uint32 per slot, 0 if empty, otherwise 1 + the entry index
+    key_offsets - uint64 per entry + 1, entry i's key is keys[key_offsets[i]:key_offsets[i + 1]]
+    keys        - the utf-8 keys, back to back
+    values      - int64 per entry: counts for words and bigrams, and for deletes the start of
+                  the entry's run in the suggestions section (n + 1 values)
+
+plus a suggestions section of uint32 word entry indices.
+"""
+
+import mmap
+import argparse
+import zlib
+import struct
+import pkg_resources
+from array import array
+from collections.abc import Mapping
+from symspellpy import SymSpell
+
+ARTIFACT_MAGIC = b'SSA1'
+#magic, max_dictionary_edit_distance, prefix_length, count_threshold, max_length, bigram_count_min
+ARTIFACT_HEADER = struct.Struct('<4siiiiq')
+SECTION = struct.Struct('<QQ')
+TABLES = ('words', 'deletes', 'bigrams')
+#SymSpell internals read (when compiling) and replaced (when loading). They're private to symspellpy,
+# so they're checked for up front rather than trusted to be there (checked against symspellpy 6.10)
+SYMSPELL_INTERNALS = ('_words', '_deletes', '_bigrams', '_max_length', '_count_threshold', 'bigram_count_min')
+TABLE_SECTIONS = ('slots', 'key_offsets', 'keys', 'values')
+
+DICTIONARY_FILE = 'frequency_dictionary_en_82_765.txt'
+BIGRAM_FILE = 'frequency_bigramdictionary_en_243_342.txt'
+
+
+def _build_table(keys, values):
+    '''The four sections of a hash table over keys, as bytes'''
+    encoded = [key.encode('utf-8') for key in keys]
+    n_slots = 1 << max(1, (2 * len(encoded)).bit_length())
+    mask = n_slots - 1
+
+    slots = array('I', [0]) * n_slots
+    key_offsets = array('Q', [0])
+    total = 0
+    for i, key in enumerate(encoded):
+        total += len(key)
+        key_offsets.append(total)
+        h = zlib.crc32(key) & mask
+        while slots[h]:
+            h = (h + 1) & mask
+        slots[h] = i + 1
+
+    return [slots.tobytes(), key_offsets.tobytes(), b''.join(encoded), array('q', values).tobytes()]
+
+
+def check_symspell_internals(sym_spell):
+    '''Raises if this symspellpy version doesn't keep its tables where the artifact code expects them'''
+    missing = [name for name in SYMSPELL_INTERNALS if not hasattr(sym_spell, name)]
+    if len(missing) > 0:
+        from importlib.metadata import version
+        raise RuntimeError('symspellpy {} has no SymSpell attributes {}, which SymSpell dictionary artifacts are '
+                           'built from. Use a symspellpy version that has them (6.10 does) or load the dictionary '
+                           'the usual way'.format(version('symspellpy'), missing))
+
+def compile_symspell_artifact(out_fp, max_dictionary_edit_distance = 2, prefix_length = 7,
+                              dictionary_path = None, bigram_path = None):
+    """
+    Parameters
+    ----------
+    out_fp : string
+        Where to write the artifact.
+    max_dictionary_edit_distance, prefix_length : int
+        SymSpell settings the deletes are computed for.
+    dictionary_path, bigram_path : string, optional
+        Word and bigram frequency files, symspellpy's English dictionaries by default. The
+        bigram file may be left out by passing False.
+
+    Returns
+    -------
+    out_fp : string
+    """
+    if dictionary_path is None:
+        dictionary_path = pkg_resources.resource_filename('symspellpy', DICTIONARY_FILE)
+    if bigram_path is None:
+        bigram_path = pkg_resources.resource_filename('symspellpy', BIGRAM_FILE)
+
+    sym_spell = SymSpell(max_dictionary_edit_distance, prefix_length)
+    check_symspell_internals(sym_spell)
+    sym_spell.load_dictionary(dictionary_path, 0, 1)
+    if bigram_path:
+        sym_spell.load_bigram_dictionary(bigram_path, 0, 2)
+
+    words = list(sym_spell._words)
+    word_index = {word: i for i, word in enumerate(words)}
+
+    deletes = list(sym_spell._deletes)
+    suggestions = array('I')
+    starts = [0]
+    for delete in deletes:
+        suggestions.extend(word_index[word] for word in sym_spell._deletes[delete])
+        starts.append(len(suggestions))
+
+    bigrams = list(sym_spell._bigrams)
+
+    sections = _build_table(words, [sym_spell._words[word] for word in words]) + \
+               _build_table(deletes, starts) + \
+               _build_table(bigrams, [sym_spell._bigrams[bigram] for bigram in bigrams]) + \
+               [suggestions.tobytes()]
+
+    header = ARTIFACT_HEADER.pack(ARTIFACT_MAGIC, max_dictionary_edit_distance, prefix_length,
+                                  sym_spell._count_threshold, sym_spell._max_length,
+                                  min(sym_spell.bigram_count_min, (1 << 63) - 1))
+    offset = ARTIFACT_HEADER.size + SECTION.size * len(sections)
+    directory = []
+    for section in sections:
+        #Sections start on 8 byte boundaries, for the int arrays
+        offset += -offset % 8
+        directory.append((offset, len(section)))
+        offset += len(section)
+
+    with open(out_fp, 'wb') as outfile:
+        outfile.write(header)
+        for section_offset, length in directory:
+            outfile.write(SECTION.pack(section_offset, length))
+        for (section_offset, _), section in zip(directory, sections):
+            outfile.write(b'\0' * (section_offset - outfile.tell()))
+            outfile.write(section)
+
+    return out_fp
+
+
+class mmap_table(Mapping):
+
+    def __init__(self, buf, sections):
+        '''Read-only str -> int mapping over a hash table in buf (a memoryview of the artifact)'''
+        slots, key_offsets, keys, values = [buf[offset:offset + length] for offset, length in sections]
+        self._slots = slots.cast('I')
+        self._key_offsets = key_offsets.cast('Q')
+        self._keys = keys
+        self._values = values.cast('q')
+        self._mask = len(self._slots) - 1
+
+    def _find(self, key):
+        '''Entry index of key, or -1'''
+        if not isinstance(key, str):
+            return -1
+        encoded = key.encode('utf-8')
+        slots, keys, key_offsets, mask = self._slots, self._keys, self._key_offsets, self._mask
+        h = zlib.crc32(encoded) & mask
+        while True:
+            i = slots[h]
+            if i == 0:
+                return -1
+            i -= 1
+            if keys[key_offsets[i]:key_offsets[i + 1]] == encoded:
+                return i
+            h = (h + 1) & mask
+
+    def _key(self, i):
+        return bytes(self._keys[self._key_offsets[i]:self._key_offsets[i + 1]]).decode('utf-8')
+
+    def _value(self, i):
+        return self._values[i]
+
+    def __getitem__(self, key):
+        i = self._find(key)
+        if i < 0:
+            raise KeyError(key)
+        return self._value(i)
+
+    def __contains__(self, key):
+        return self._find(key) >= 0
+
+    def __len__(self):
+        return len(self._key_offsets) - 1
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self._key(i)
+
+
+class mmap_deletes(mmap_table):
+
+    def __init__(self, buf, sections, suggestions, words):
+        '''Read-only delete -> list of dictionary words mapping, the words coming from the words table'''
+        super().__init__(buf, sections)
+        self._suggestions = suggestions.cast('I')
+        self._words = words
+
+    def _value(self, i):
+        return [self._words._key(j) for j in self._suggestions[self._values[i]:self._values[i + 1]]]
+
+
+def load_symspell_artifact(fp):
+    """
+    Parameters
+    ----------
+    fp : string
+        Artifact written by compile_symspell_artifact.
+
+    Returns
+    -------
+    sym_spell : SymSpell
+        Ready for lookup/lookup_compound, with its word, delete and bigram tables read straight
+        out of the mapped file. Those are read-only, so words can't be added to or removed from it.
+    """
+    with open(fp, 'rb') as infile:
+        mapped = mmap.mmap(infile.fileno(), 0, access = mmap.ACCESS_READ)
+    buf = memoryview(mapped)
+
+    magic, max_dictionary_edit_distance, prefix_length, count_threshold, max_length, bigram_count_min = \
+                            ARTIFACT_HEADER.unpack_from(buf)
+    if magic != ARTIFACT_MAGIC:
+        raise ValueError('{} is not a SymSpell dictionary artifact!'.format(fp))
+    n_sections = len(TABLES) * len(TABLE_SECTIONS) + 1
+    directory = [SECTION.unpack_from(buf, ARTIFACT_HEADER.size + SECTION.size * i) for i in range(n_sections)]
+    tables = {name: directory[i * len(TABLE_SECTIONS):(i + 1) * len(TABLE_SECTIONS)] for i, name in enumerate(TABLES)}
+    suggestions_offset, suggestions_length = directory[-1]
+
+    sym_spell = SymSpell(max_dictionary_edit_distance, prefix_length, count_threshold)
+    check_symspell_internals(sym_spell)
+    sym_spell._words = mmap_table(buf, tables['words'])
+    sym_spell._deletes = mmap_deletes(buf, tables['deletes'],
+                                      buf[suggestions_offset:suggestions_offset + suggestions_length],
+                                      sym_spell._words)
+    sym_spell._bigrams = mmap_table(buf, tables['bigrams'])
+    sym_spell._max_length = max_length
+    sym_spell.bigram_count_min = bigram_count_min
+    return sym_spell
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Compile a memory-mapped SymSpell dictionary artifact')
+    parser.add_argument('out_file')
+    parser.add_argument('max_dictionary_edit_distance', type = int, nargs = '?', default = 2)
+    parser.add_argument('prefix_length', type = int, nargs = '?', default = 7)
+    args = parser.parse_args()
+    print(compile_symspell_artifact(args.out_file, args.max_dictionary_edit_distance, args.prefix_length))
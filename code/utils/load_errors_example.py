@@ -2,17 +2,21 @@
 Analysis script checking out the results saved in error_counts files
 '''
 
-import numpy as np
+import os, sys
 import json
 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from error_matrix import load_error_counts
+
+#Reads both the sparse .npz counts align_json_texts writes now and the older dense .npy ones
 fp = r'C:\Users\bryan\Documents\NBER\OCR_error_correction\data\error_counts_symspell.npy'
-symspell_counts = np.load(fp)
+symspell_counts = load_error_counts(fp)
 
 fp = r'C:\Users\bryan\Documents\NBER\OCR_error_correction\data\error_counts_new_visual_homoglyph.npy'
-homoglyph_counts = np.load(fp)
+homoglyph_counts = load_error_counts(fp)
 
 fp = r'C:\Users\bryan\Documents\NBER\OCR_error_correction\data\error_counts.npy'
-reg_counts = np.load(fp)
+reg_counts = load_error_counts(fp)
 
 homoglyphs_path = r'C:\Users\bryan\Documents\NBER\OCR_error_correction\code\utils\homoglyph_list.json'
 with open(homoglyphs_path, 'r') as infile:
@@ -35,30 +39,27 @@ def create_glyphs_dict(glyphs):
 g_dict = create_glyphs_dict(glyphs)
 
 reg_counts_total = 0
-for i in range(reg_counts.shape[0]):
-    for j in range(reg_counts.shape[0]):
-        if chr(i).isalnum() and chr(j).isalnum():
-            reg_counts_total += g_dict.get(chr(i), {}).get(chr(j), 0) * reg_counts[i, j]
+for (gold_chr, ocr_chr), count in reg_counts.items():
+    if gold_chr.isalnum() and ocr_chr.isalnum():
+        reg_counts_total += g_dict.get(gold_chr, {}).get(ocr_chr, 0) * count
 
 # print(reg_counts_total)
 print('Reg Avg')
 print(reg_counts_total / reg_counts.sum())
 
 sym_counts_total = 0
-for i in range(symspell_counts.shape[0]):
-    for j in range(symspell_counts.shape[0]):
-        if chr(i).isalnum() and chr(j).isalnum():
-            sym_counts_total += g_dict.get(chr(i), {}).get(chr(j), 0) * symspell_counts[i, j]
+for (gold_chr, ocr_chr), count in symspell_counts.items():
+    if gold_chr.isalnum() and ocr_chr.isalnum():
+        sym_counts_total += g_dict.get(gold_chr, {}).get(ocr_chr, 0) * count
 
 # print(sym_counts_total)
 print('Symspell Avg')
 print(sym_counts_total / symspell_counts.sum())
 
 # hom_counts_total = 0
-# for i in range(homoglyph_counts.shape[0]):
-#     for j in range(homoglyph_counts.shape[0]):
-#         if chr(i).isalnum() and chr(j).isalnum():
-#             hom_counts_total += g_dict.get(chr(i), {}).get(chr(j), 0) * homoglyph_counts[i, j]
+# for (gold_chr, ocr_chr), count in homoglyph_counts.items():
+#     if gold_chr.isalnum() and ocr_chr.isalnum():
+#         hom_counts_total += g_dict.get(gold_chr, {}).get(ocr_chr, 0) * count
 
 # # print(hom_counts_total)
 # print(hom_counts_total / homoglyph_counts.sum())